@@ -0,0 +1,233 @@
+import argparse
+import csv
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import mock_server
+import requests
+
+'''
+Throughput benchmark for the updater. A synthetic CSV file is generated (or an existing one is used), the stand-in Pure and
+Crossref servers from mock_server.py are started, and pure_updater.py is run once per mode as a separate process against them.
+For each mode the report gives records per second, requests per record (counted by the stand-in servers, including requests
+answered with a 429 or 500 error) and the peak memory of the updater process.
+
+Modes:
+* serial: one record and one request at a time, every DOI looked up on its own (the behaviour of the original script)
+* concurrent: the default worker and concurrency settings, every DOI looked up on its own
+* batched: the default settings with batch lookups through the works endpoint
+* cached: as batched, measured on a second run after a first run has filled the Crossref cache
+* incremental: --incremental, measured on a second run after a first run has recorded the sync state
+* prefetch: as batched, reading the research outputs through the search endpoint (--prefetch)
+
+Run it again after a change and compare the reports (--json writes them to a file) to catch regressions.
+'''
+
+MODES = {
+    "serial": ["--record-workers", "1", "--pure-concurrency", "1", "--crossref-concurrency", "1", "--no-batch-lookup", "--no-cache"],
+    "concurrent": ["--no-batch-lookup", "--no-cache"],
+    "batched": ["--no-cache"],
+    "cached": [],
+    "incremental": ["--incremental"],
+    "prefetch": ["--no-cache", "--prefetch", "--batch-size", "200"],
+}
+
+'''
+Modes measured on the second of two runs, because they depend on what the first run left behind.
+'''
+
+WARM_UP_MODES = {"cached", "incremental"}
+
+UPDATER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pure_updater.py")
+
+
+def row_count(value: str) -> int:
+
+    """
+    Returns the number of rows for a --rows value, which may use a k or m suffix (e.g. 100k or 1m)
+    """
+
+    multipliers = {"k": 1000, "m": 1000000}
+    value = value.strip().lower()
+    if value[-1:] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def generate_csv(path: str, rows: int, seed: int = 0):
+
+    """
+    Writes a CSV file of research outputs in the layout of a Pure export. About 1% of rows repeat an earlier DOI, 1% have no DOI
+    and some DOIs are written as doi.org links, as they are in real exports.
+    """
+
+    generator = random.Random(seed)
+    with open(path, "w", newline = "", encoding = "utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Title", "UUID", "DOI"])
+        for row in range(rows):
+            chance = generator.random()
+            if chance < 0.01:
+                doi = ""
+            elif chance < 0.02 and row > 0:
+                doi = f"10.5555/bench.{generator.randrange(row)}"
+            elif chance < 0.10:
+                doi = f"https://doi.org/10.5555/BENCH.{row}"
+            else:
+                doi = f"10.5555/bench.{row}"
+            writer.writerow([f"Research output {row}", str(uuid.UUID(int = generator.getrandbits(128), version = 4)), doi])
+
+
+def run_updater(arguments: list) -> tuple:
+
+    """
+    Runs pure_updater.py in a new process and returns its wall time in seconds and peak memory in MB (None where the operating
+    system does not report it)
+    """
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, UPDATER] + arguments, stdin = subprocess.DEVNULL,
+                               stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        '''
+        wait4 reports the resource usage of this one process, so the peak memory of every mode is measured separately. ru_maxrss is
+        in kilobytes on Linux and in bytes on macOS.
+        '''
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = time.perf_counter() - started
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak_mb = usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+        errors = process.stderr.read()
+        process.stderr.close()
+    else:
+        _, errors = process.communicate()
+        seconds = time.perf_counter() - started
+        peak_mb = None
+
+    if process.returncode != 0:
+        raise RuntimeError(f"pure_updater.py failed:\n{errors.decode('utf-8', 'replace')[-2000:]}")
+    return seconds, peak_mb
+
+
+def stage_latencies(run_log_path: str) -> dict:
+
+    """
+    Returns the per-stage summary written at the end of a run log
+    """
+
+    summary = {}
+    with open(run_log_path, "rb") as run_log_file:
+        for line in run_log_file:
+            entry = json.loads(line)
+            if entry.get("event") == "summary":
+                summary = entry["stages"]
+    return summary
+
+
+def benchmark(csv_path: str, rows: int, modes: list, work_folder: str, pure_url: str, crossref_url: str) -> list:
+
+    """
+    Runs the updater in each mode against the stand-in servers and returns a report for every mode
+    """
+
+    reports = []
+    for mode in modes:
+        out_folder = os.path.join(work_folder, mode)
+        os.makedirs(out_folder, exist_ok = True)
+        arguments = ["--csv", csv_path, "--url", f"{pure_url}/ws/api/research-outputs/", "--crossref-url", crossref_url,
+                     "--doi-col", "DOI", "--uuid-col", "UUID", "--out-folder", out_folder, "--api-key", "benchmark"] + MODES[mode]
+
+        if mode in WARM_UP_MODES:
+            requests.post(f"{pure_url}/_reset")
+            run_updater(arguments)
+
+        requests.post(f"{pure_url}/_reset")
+        seconds, peak_mb = run_updater(arguments)
+        counts = requests.get(f"{pure_url}/_stats").json()
+        total_requests = sum(count for name, count in counts.items() if name != "pure_conflict")
+
+        report = {
+            "mode": mode,
+            "records": rows,
+            "seconds": round(seconds, 2),
+            "records_per_second": round(rows / seconds, 1),
+            "requests_per_record": round(total_requests / rows, 3) if rows else 0.0,
+            "peak_memory_mb": round(peak_mb, 1) if peak_mb is not None else None,
+            "requests": counts,
+            "stages": stage_latencies(os.path.join(out_folder, "run_log.jsonl")),
+        }
+        reports.append(report)
+        print(f"{mode:<11} {rows:>9} records {report['seconds']:>9.2f} s {report['records_per_second']:>9.1f} records/s "
+              f"{report['requests_per_record']:>6.2f} requests/record   peak memory "
+              f"{'n/a' if peak_mb is None else format(peak_mb, '.1f') + ' MB'}", flush = True)
+    return reports
+
+
+def main(argv: list = None):
+
+    """
+    Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description = "Measure the throughput of the updater against local stand-in servers.")
+    parser.add_argument("--rows", default = "1k", help = "number of rows in the generated CSV file, e.g. 1k, 100k or 1m")
+    parser.add_argument("--csv", help = "use this CSV file (with UUID and DOI columns) instead of generating one")
+    parser.add_argument("--generate-only", metavar = "PATH", help = "write a generated CSV file to PATH and exit")
+    parser.add_argument("--modes", default = ",".join(MODES), help = f"comma separated list of modes to run ({', '.join(MODES)})")
+    parser.add_argument("--work-folder", help = "folder for the generated CSV file and the output of each run (defaults to a "
+                                                "temporary folder)")
+    parser.add_argument("--json", help = "also write the reports to this file")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed for the generated CSV file")
+    parser.add_argument("--pure-port", type = int, default = mock_server.PURE_PORT)
+    parser.add_argument("--crossref-port", type = int, default = mock_server.CROSSREF_PORT)
+    parser.add_argument("--latency-ms", type = float, default = mock_server.LATENCY_MS)
+    parser.add_argument("--jitter-ms", type = float, default = mock_server.JITTER_MS)
+    parser.add_argument("--error-rate", type = float, default = 0.0)
+    parser.add_argument("--throttle-rate", type = float, default = 0.0)
+    parser.add_argument("--retry-after", type = float, default = 0.1)
+    parser.add_argument("--non-crossref-rate", type = float, default = 0.05)
+    parser.add_argument("--update-rate", type = float, default = 0.02)
+    args = parser.parse_args(argv)
+
+    if args.generate_only is not None:
+        generate_csv(args.generate_only, row_count(args.rows), args.seed)
+        return []
+
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"unknown mode {mode!r}")
+
+    work_folder = args.work_folder or tempfile.mkdtemp(prefix = "pure_updater_benchmark_")
+    os.makedirs(work_folder, exist_ok = True)
+    csv_path = args.csv
+    if csv_path is None:
+        csv_path = os.path.join(work_folder, "research_outputs.csv")
+        generate_csv(csv_path, row_count(args.rows), args.seed)
+    with open(csv_path, "r", newline = "", encoding = "utf-8-sig") as csv_file:
+        rows = sum(1 for _ in csv.reader(csv_file)) - 1
+
+    state = mock_server.MockState(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.retry_after,
+                                  args.non_crossref_rate, args.update_rate)
+    servers = mock_server.start(state, args.pure_port, args.crossref_port)
+    try:
+        reports = benchmark(csv_path, rows, modes, work_folder, f"http://127.0.0.1:{args.pure_port}",
+                            f"http://127.0.0.1:{args.crossref_port}")
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    if args.json is not None:
+        with open(args.json, "w", encoding = "utf-8") as json_file:
+            json.dump(reports, json_file, indent = 2)
+    print(f"Output of each run is in {work_folder}")
+    return reports
+
+
+if __name__ == "__main__":
+    main()
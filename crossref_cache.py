@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import oa_transform
+from crossref_data_harvester import normalize_doi
+
+'''
+Default lifetimes (in days) for cached Crossref results. Verdicts that a DOI is registered with another agency (or that Crossref
+does not know it at all) practically never change, so they are kept the longest. Embargoed records are re-checked often because their status flips once the license start
+date has passed; they never outlive their embargo date.
+'''
+
+DEFAULT_TTL_DAYS = 30
+NON_CROSSREF_TTL_DAYS = 180
+EMBARGO_TTL_DAYS = 7
+DEFAULT_MAX_ENTRIES = 2000000
+
+DAY_SECONDS = 24 * 60 * 60
+
+
+class CrossrefCache:
+
+    """
+    Persistent SQLite cache of parsed Crossref results and registration agency verdicts, keyed by normalized DOI
+    """
+
+    def __init__(self, path: str, ttl_days: float = DEFAULT_TTL_DAYS, non_crossref_ttl_days: float = NON_CROSSREF_TTL_DAYS,
+                 embargo_ttl_days: float = EMBARGO_TTL_DAYS, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl_days * DAY_SECONDS
+        self.non_crossref_ttl = non_crossref_ttl_days * DAY_SECONDS
+        self.embargo_ttl = embargo_ttl_days * DAY_SECONDS
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS crossref_cache ("
+            "doi TEXT PRIMARY KEY, license TEXT, date TEXT, embargo TEXT, agency TEXT, fetched_at REAL, expires_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS crossref_cache_fetched_at ON crossref_cache (fetched_at)")
+        self.connection.commit()
+
+    def expiry(self, response_dict: dict, agency: str, now: float) -> float:
+
+        """
+        Returns the time at which a result fetched at "now" should be looked up again
+        """
+
+        if agency != "crossref":
+            return now + self.non_crossref_ttl
+        if response_dict["embargo"] is not None:
+            embargo_end = datetime.strptime(response_dict["embargo"], "%Y-%m-%d").timestamp()
+            return min(now + self.embargo_ttl, embargo_end)
+        return now + self.ttl
+
+    def get_many(self, dois: list) -> dict:
+
+        """
+        Returns a dictionary keyed by DOI with the cached Crossref data for every DOI that has an unexpired cache entry
+        """
+
+        keys = {}
+        for doi in dois:
+            keys.setdefault(normalize_doi(doi), []).append(doi)
+
+        found = {}
+        now = time.time()
+        key_list = list(keys)
+        with self.lock:
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT doi, license, date, embargo, expires_at FROM crossref_cache WHERE doi IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, license_url, date, embargo, expires_at in rows:
+                    if expires_at <= now:
+                        self.stats["expired"] += 1
+                        continue
+                    epub = oa_transform.date_from_string(date) if date is not None else None
+                    for doi in keys[key]:
+                        found[doi] = {"license": license_url, "date": epub, "embargo": embargo}
+
+            self.stats["hits"] += len(found)
+            self.stats["misses"] += len(dois) - len(found)
+
+        return found
+
+    def set_many(self, results: list):
+
+        """
+        Stores a list of (doi, response_dict, agency) tuples in the cache
+        """
+
+        if not results:
+            return
+
+        now = time.time()
+        rows = [
+            (normalize_doi(doi), response_dict["license"],
+             oa_transform.date_to_string(response_dict["date"]) if response_dict["date"] is not None else None,
+             response_dict["embargo"], agency, now,
+             self.expiry(response_dict, agency, now))
+            for doi, response_dict, agency in results
+        ]
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO crossref_cache VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.connection.commit()
+            self.stats["stored"] += len(rows)
+
+    def evict(self):
+
+        """
+        Removes expired entries and, if the cache is still larger than max_entries, the entries that were fetched longest ago
+        """
+
+        with self.lock:
+            expired = self.connection.execute("DELETE FROM crossref_cache WHERE expires_at <= ?", (time.time(),)).rowcount
+            count = self.connection.execute("SELECT COUNT(*) FROM crossref_cache").fetchone()[0]
+            overflow = 0
+            if count > self.max_entries:
+                overflow = self.connection.execute(
+                    "DELETE FROM crossref_cache WHERE doi IN (SELECT doi FROM crossref_cache ORDER BY fetched_at LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+            self.connection.commit()
+            self.stats["evicted"] += expired + overflow
+
+    def close(self):
+
+        """
+        Evicts stale entries and closes the cache file
+        """
+
+        self.evict()
+        with self.lock:
+            self.connection.close()
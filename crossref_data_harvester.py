@@ -1,92 +1,321 @@
 import requests as re
-from datetime import datetime
+import http_client
+import json_codec
+import run_log
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import oa_transform
+from datetime import date
 
+'''
+Requests to Crossref may be issued from several worker threads at once. crossref_slots caps how many are in flight at the same
+time.
+'''
 
-def get_crossref_license_date(doi: str, out_folder: str) -> dict:
+crossref_slots_limit = 2
+crossref_slots = threading.BoundedSemaphore(crossref_slots_limit)
+
+'''
+Base URL of the Crossref REST API. It can be pointed at a stand-in server (see mock_server.py) with set_crossref_api.
+'''
+
+CROSSREF_API = "https://api.crossref.org"
+crossref_api = CROSSREF_API
+
+'''
+Agency recorded for a DOI that Crossref answered with a 404 (or another final client error). This is a verdict about the DOI,
+not a failed lookup, so it is cached like a DOI registered with another agency rather than looked up again on every run.
+'''
+
+NOT_FOUND = "not-found"
+
+
+def set_crossref_concurrency(limit: int):
+
+    """
+    Sets the maximum number of concurrent requests to the Crossref API
+    """
+
+    global crossref_slots, crossref_slots_limit
+    crossref_slots_limit = limit
+    crossref_slots = threading.BoundedSemaphore(limit)
+
+
+def set_crossref_api(base_url: str):
+
+    """
+    Sets the base URL that Crossref requests are sent to
+    """
+
+    global crossref_api
+    crossref_api = base_url.rstrip("/")
+
+
+def parse_crossref_work(work: dict) -> dict:
+
+    """
+    Returns a dictionary with license, e-pub date (an oa_transform.PartialDate, or None if Crossref has no usable date), and
+    embargo value parsed from a single Crossref work record
+    """
+
+    response_dict = {"license": None, "date": None, "embargo": None}
+
+    '''
+    Access "published-online" key within the work record.
+    '''
+    epub = work.get("published-online")
+    if epub is not None:
+        response_dict["date"] = oa_transform.date_from_parts(epub.get("date-parts"))
+    '''
+    Access "license" key within the work record and set an embargo date if the license start date is after today.
+    '''
+    licenses = work.get("license")
+    if licenses is not None:
+        for this_license in licenses:
+            if this_license.get("content-version") == "vor":
+                vor_license = str(this_license.get("URL"))
+                license_start = oa_transform.date_from_parts((this_license.get("start") or {}).get("date-parts"))
+                response_dict["embargo"] = oa_transform.embargo_end(license_start, date.today())
+                response_dict["license"] = vor_license
+                break
+
+    return response_dict
+
+
+def normalize_doi(doi: str) -> str:
+
+    """
+    Returns the bare, lowercase form of a DOI with any resolver prefix removed
+    """
+
+    doi = doi.strip().lower()
+    for prefix in ("https://doi.org/", "http://doi.org/", "https://dx.doi.org/", "http://dx.doi.org/", "doi:"):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+            break
+    return doi.strip()
+
+
+def transient_failure(err: re.exceptions.RequestException) -> bool:
+
+    """
+    Returns whether a failed Crossref request may succeed when repeated later: no response at all (a connection error or a
+    timeout), a 429 or a 5xx error
+    """
+
+    response = getattr(err, "response", None)
+    return response is None or response.status_code == 429 or response.status_code >= 500
+
+
+def get_crossref_license_date(doi: str) -> dict:
 
     """
     Returns a dictionary with CrossRef data for license, e-pub date, and embargo value
     """
 
+    return lookup_crossref_doi(doi)[0]
+
+
+def lookup_crossref_doi(doi: str) -> tuple:
+
+    """
+    Returns the CrossRef data dictionary for a DOI together with the id of its registration agency. The agency is NOT_FOUND if
+    Crossref gave a final "no" for the DOI (e.g. a 404), and None if either request failed for a transient reason, so that the
+    result is not mistaken for a complete lookup.
+    """
+
     response_dict = {"license": None, "date": None, "embargo": None}
+    agency = None
 
     headers = {"accept": "application/json"}
 
-    doi = re.utils.quote(doi, safe = "")
+    quoted_doi = re.utils.quote(doi, safe = "")
 
     '''
-    Make a GET request to CrossRef API to check that the DOI for the Pure RO is a CrossRef DOI. If it is not, write this to an error file. 
-    Otherwise, continue with the next GET request.
+    Make a GET request to CrossRef API to check that the DOI for the Pure RO is a CrossRef DOI. If it is not, record this in the
+    run log. Otherwise, continue with the next GET request.
     '''
 
-    crossref_errors = open(f"{out_folder}/crossref_errors.txt", "a", encoding = "utf-8-sig", errors = "replace")
     response = None
     agency_response = None
     try:
-        agency_response = re.get(f"https://api.crossref.org/works/{doi}/agency", headers = headers, timeout = 10)
+        with crossref_slots:
+            agency_response = http_client.get(f"{crossref_api}/works/{quoted_doi}/agency", "crossref_agency",
+                                              headers = headers, timeout = 10)
         agency_response.raise_for_status()
     except re.exceptions.HTTPError as errh:
-        print("HTTP Error: " + str(errh) + '\n' + errh.response.text + '\n\n')
-        crossref_errors.write("HTTP Error: " + str(errh) + '\n' + errh.response.text + '\n\n')
+        run_log.log("error", stage = "crossref_agency", doi = doi, message = "HTTP Error: " + str(errh), response = errh.response.text)
+        if not transient_failure(errh):
+            agency = NOT_FOUND
     except re.exceptions.ConnectionError as errc:
-        print("Error Connecting for url: " + f"https://api.crossref.org/works/{doi}/agency" + "\n" + str(errc) +  '\n\n')
-        crossref_errors.write("Error Connecting for url: " + f"https://api.crossref.org/works/{doi}/agency" + "\n" + str(errc) +  '\n\n')
+        run_log.log("error", stage = "crossref_agency", doi = doi, message = "Error Connecting: " + str(errc))
     except re.exceptions.Timeout as errt:
-        print("Timeout Error for url: " + f"https://api.crossref.org/works/{doi}/agency" + "\n" + str(errt) +  '\n\n')
-        crossref_errors.write("Timeout error for url: " + f"https://api.crossref.org/works/{doi}/agency" + "\n" + str(errt) +  '\n\n')
+        run_log.log("error", stage = "crossref_agency", doi = doi, message = "Timeout Error: " + str(errt))
     except re.exceptions.RequestException as err:
-        print("Something went wrong: " + str(err) + '\n' + err.response.text + '\n\n')
-        crossref_errors.write("Something went wrong: " + str(err) + '\n' + err.response.text + '\n\n')
+        run_log.log("error", stage = "crossref_agency", doi = doi, message = "Something went wrong: " + str(err))
     else:
-        agency_response_json = agency_response.json()
-        if agency_response_json["message"]["agency"]["id"] == "crossref":
+        agency_response_json = json_codec.loads(agency_response.content)
+        agency_id = agency_response_json["message"]["agency"]["id"]
+        if agency_id == "crossref":
             try:
-                response = re.get(f"https://api.crossref.org/works/{doi}", headers=headers, timeout=10)
+                with crossref_slots:
+                    response = http_client.get(f"{crossref_api}/works/{quoted_doi}", "crossref_works",
+                                               headers = headers, timeout = 10)
                 response.raise_for_status()
             except re.exceptions.HTTPError as errh:
-                print("HTTP Error: " + str(errh) + '\n' + errh.response.text + '\n\n')
-                crossref_errors.write("HTTP Error: " + str(errh) + '\n' + errh.response.text + '\n\n')
+                run_log.log("error", stage = "crossref_works", doi = doi, message = "HTTP Error: " + str(errh), response = errh.response.text)
+                if not transient_failure(errh):
+                    agency = NOT_FOUND
             except re.exceptions.ConnectionError as errc:
-                print("Error Connecting for url: " + f"https://api.crossref.org/works/{doi}" + "\n" + str(errc) +  '\n\n')
-                crossref_errors.write("Error Connecting for url: " + f"https://api.crossref.org/works/{doi}" + "\n" + str(errc) +  '\n\n')
+                run_log.log("error", stage = "crossref_works", doi = doi, message = "Error Connecting: " + str(errc))
             except re.exceptions.Timeout as errt:
-                print("Timeout Error for url: " + f"https://api.crossref.org/works/{doi}" + "\n" + str(errt) +  '\n\n')
-                crossref_errors.write("Timeout Error for url: " + f"https://api.crossref.org/works/{doi}" + "\n" + str(errt) +  '\n\n')
+                run_log.log("error", stage = "crossref_works", doi = doi, message = "Timeout Error: " + str(errt))
             except re.exceptions.RequestException as err:
-                print("Something went wrong: " + str(err) + '\n' + err.response.text + '\n\n')
-                crossref_errors.write("Something went wrong: " + str(err) + '\n' + err.response.text + '\n\n')
+                run_log.log("error", stage = "crossref_works", doi = doi, message = "Something went wrong: " + str(err))
             else:
-                response_json = response.json()
-                '''
-                Access "published-online" key within the json response object. 
-                '''
-                epub = response_json.get("message").get("published-online")
-                if epub is not None:
-                    epub_date = str(epub["date-parts"]).strip("[]")
-                    response_dict["date"] = epub_date
-                '''
-                Access "license" key within the json response object and set an embargo date if the license start date is after today.
-                '''
-                licenses = response_json.get("message").get("license")
-                if licenses is not None:
-                    for this_license in licenses:
-                        if this_license.get("content-version") == "vor":
-                            vor_license = str(this_license.get("URL"))
-                            license_start = str(this_license.get("start").get("date-parts")).strip("[]")
-                            for format_string in ("%Y, %m, %d", "%Y, %m", "%Y"):
-                                try:
-                                    license_start = datetime.strptime(license_start, format_string).date()
-                                    break
-                                except ValueError:
-                                    continue
-                            if license_start > datetime.today().date():
-                                license_start = datetime.strftime(license_start, "%Y-%m-%d")
-                                response_dict["embargo"] = license_start
-                            response_dict["license"] = vor_license
-                            break
+                response_dict = parse_crossref_work(json_codec.loads(response.content).get("message"))
+                agency = agency_id
         else:
-            crossref_errors.write(f"{doi} is not a CrossRef DOI" + '\n\n')
+            agency = agency_id
+            run_log.log("not_crossref", stage = "crossref_agency", doi = doi, agency = agency_id,
+                        message = f"{doi} is not a CrossRef DOI")
 
-    crossref_errors.close()
+    return response_dict, agency
 
-    return response_dict
+
+def query_works(dois: list, stage: str, filters: list = ()) -> dict:
+
+    """
+    Returns the work records for a list of DOIs from a single request to the works endpoint, keyed by lowercased DOI. Extra
+    filters (e.g. "from-update-date:2024-05-01") narrow the result down further. Raises the request's exception if it failed.
+    """
+
+    params = {
+        "filter": ",".join(list(filters) + [f"doi:{doi}" for doi in dois]),
+        "select": "DOI,license,published-online",
+        "rows": len(dois),
+    }
+    with crossref_slots:
+        response = http_client.get(f"{crossref_api}/works", stage, params = params, headers = {"accept": "application/json"},
+                                   timeout = 30)
+    response.raise_for_status()
+
+    works = {}
+    for work in json_codec.loads(response.content)["message"]["items"]:
+        works[work["DOI"].lower()] = work
+    return works
+
+
+def get_crossref_license_dates(dois: list, chunk_size: int = 50, cache = None, snapshot = None,
+                               offline: bool = False, batch_lookup: bool = True, failed: set = None) -> dict:
+
+    """
+    Returns a dictionary keyed by DOI with the same CrossRef data as get_crossref_license_date for every DOI in the list.
+    If a CrossrefSnapshot is given, DOIs found in the local index are answered from it. If a CrossrefCache is given, cached
+    results are used where they have not expired and new results are stored in it. With offline, the Crossref API is never
+    called and DOIs that could not be answered locally are left out of the result. Without batch_lookup, every DOI is looked up
+    on its own with get_crossref_license_date. If a failed set is given, the DOIs whose lookup failed for a transient reason
+    (and which therefore hold empty data rather than "no data") are added to it.
+    """
+
+    results = {}
+
+    '''
+    Look the DOIs up in chunks through the works endpoint, which accepts several "doi:" filters in one request. Only the fields
+    needed for license and e-pub data are selected to keep the responses small. DOIs containing a comma cannot be expressed
+    in the filter, so they go straight to the single-DOI lookup.
+    '''
+
+    unique_dois = list(dict.fromkeys(doi for doi in dois if isinstance(doi, str)))
+    if snapshot is not None:
+        indexed = snapshot.get_many(unique_dois)
+        results.update(indexed)
+        unique_dois = [doi for doi in unique_dois if doi not in indexed]
+    if cache is not None:
+        cached = cache.get_many(unique_dois)
+        results.update(cached)
+        unique_dois = [doi for doi in unique_dois if doi not in cached]
+    if offline:
+        return results
+    fetched = []
+
+    missing = [doi for doi in unique_dois if "," in doi or not batch_lookup]
+    batchable = [doi for doi in unique_dois if "," not in doi and batch_lookup]
+
+    for start in range(0, len(batchable), chunk_size):
+        chunk = batchable[start:start + chunk_size]
+        try:
+            works = query_works(chunk, "crossref_filter")
+        except re.exceptions.RequestException as err:
+            run_log.log("error", stage = "crossref_filter", dois = chunk,
+                        message = "Batch lookup failed, falling back to single DOI lookups: " + str(err))
+            missing.extend(chunk)
+            continue
+
+        for doi in chunk:
+            work = works.get(doi.lower())
+            if work is None:
+                missing.append(doi)
+            else:
+                results[doi] = parse_crossref_work(work)
+                fetched.append((doi, results[doi], "crossref"))
+
+    '''
+    DOIs that did not come back from the works endpoint are either not Crossref DOIs or not indexed yet. Run the full
+    agency check for these so that the reason ends up in the run log just as it would for a single lookup. Only lookups that
+    failed for a transient reason count as failed; a DOI Crossref does not know is a final answer and is cached as such.
+    '''
+
+    if missing:
+        with ThreadPoolExecutor(max_workers = crossref_slots_limit) as executor:
+            for doi, (response_dict, agency) in zip(missing, executor.map(lookup_crossref_doi, missing)):
+                results[doi] = response_dict
+                if agency is not None:
+                    fetched.append((doi, response_dict, agency))
+                elif failed is not None:
+                    failed.add(doi)
+
+    if cache is not None:
+        cache.set_many(fetched)
+
+    return results
+
+
+def get_crossref_updates(dois: list, since: str, chunk_size: int = 50, cache = None, failed: set = None) -> dict:
+
+    """
+    Returns a dictionary keyed by DOI with the same CrossRef data as get_crossref_license_date for the DOIs in the list whose
+    Crossref metadata was updated on or after "since" (YYYY-MM-DD). DOIs whose update check failed are looked up in full, so a
+    failed request never hides an update; DOIs whose full lookup failed as well are added to the failed set, if one is given.
+    New results are stored in the CrossrefCache, if one is given.
+    """
+
+    results = {}
+    fetched = []
+
+    unique_dois = list(dict.fromkeys(doi for doi in dois if isinstance(doi, str)))
+    unchecked = [doi for doi in unique_dois if "," in doi]
+    checkable = [doi for doi in unique_dois if "," not in doi]
+
+    for start in range(0, len(checkable), chunk_size):
+        chunk = checkable[start:start + chunk_size]
+        try:
+            works = query_works(chunk, "crossref_updates", [f"from-update-date:{since}"])
+        except re.exceptions.RequestException as err:
+            run_log.log("error", stage = "crossref_updates", dois = chunk,
+                        message = "Update check failed, falling back to full lookups: " + str(err))
+            unchecked.extend(chunk)
+            continue
+
+        for doi in chunk:
+            work = works.get(doi.lower())
+            if work is not None:
+                results[doi] = parse_crossref_work(work)
+                fetched.append((doi, results[doi], "crossref"))
+
+    if cache is not None:
+        cache.set_many(fetched)
+    if unchecked:
+        results.update(get_crossref_license_dates(unchecked, chunk_size, cache, failed = failed))
+
+    return results
@@ -0,0 +1,185 @@
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+from crossref_data_harvester import normalize_doi, parse_crossref_work
+from record_reader import read_records
+
+'''
+Offline backend for full-catalog backfills. build_index streams the works in a Crossref public data file (a directory of
+gzipped JSON files, each holding {"items": [...]}) or in JSON lines dumps and keeps only what the updater needs: the version of
+record licenses and the published-online date of each DOI. CrossrefSnapshot answers lookups from that index without any
+network calls. Every work in a Crossref dump is registered with Crossref, so the agency of every indexed DOI is "crossref".
+'''
+
+INSERT_BATCH_SIZE = 10000
+MMAP_SIZE = 1 << 30
+
+
+def dump_files(source: str) -> list:
+
+    """
+    Returns the dump files found at a path, which may be a single file or a directory of .json, .jsonl, .json.gz and .jsonl.gz files
+    """
+
+    if os.path.isfile(source):
+        return [source]
+
+    files = []
+    for directory, _, names in os.walk(source):
+        for name in names:
+            if name.endswith((".json", ".jsonl", ".json.gz", ".jsonl.gz")):
+                files.append(os.path.join(directory, name))
+    return sorted(files)
+
+
+def read_works(path: str):
+
+    """
+    Yields every work record in a dump file
+    """
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding = "utf-8") as dump_file:
+        if path.endswith((".jsonl", ".jsonl.gz")):
+            for line in dump_file:
+                line = line.strip()
+                if line:
+                    work = json.loads(line)
+                    yield work.get("message", work)
+        else:
+            data = json.load(dump_file)
+            if isinstance(data, dict):
+                data = data.get("items", data.get("message", {}).get("items", []))
+            yield from data
+
+
+def compact_work(work: dict) -> dict:
+
+    """
+    Returns the parts of a work record that parse_crossref_work reads
+    """
+
+    compact = {}
+    licenses = [
+        {"content-version": "vor", "URL": this_license.get("URL"), "start": this_license.get("start")}
+        for this_license in work.get("license") or []
+        if this_license.get("content-version") == "vor"
+    ]
+    if licenses:
+        compact["license"] = licenses
+    if work.get("published-online") is not None:
+        compact["published-online"] = {"date-parts": work["published-online"]["date-parts"]}
+    return compact
+
+
+def open_index(index_path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(index_path)
+    connection.execute("CREATE TABLE IF NOT EXISTS crossref_snapshot (doi TEXT PRIMARY KEY, agency TEXT, work TEXT)")
+    return connection
+
+
+def build_index(source: str, index_path: str, only_dois: set = None) -> int:
+
+    """
+    Builds (or adds to) a SQLite index of DOI -> license, published-online date and agency from a Crossref dump and returns the
+    number of works indexed. If only_dois is given, only those (normalized) DOIs are kept, which keeps the index small when
+    just one repository's outputs need to be backfilled.
+    """
+
+    connection = open_index(index_path)
+    connection.execute("PRAGMA synchronous=OFF")
+    connection.execute("PRAGMA journal_mode=MEMORY")
+
+    indexed = 0
+    rows = []
+    for path in dump_files(source):
+        for work in read_works(path):
+            doi = work.get("DOI")
+            if doi is None:
+                continue
+            doi = normalize_doi(doi)
+            if only_dois is not None and doi not in only_dois:
+                continue
+            rows.append((doi, "crossref", json.dumps(compact_work(work), separators = (",", ":"))))
+            if len(rows) >= INSERT_BATCH_SIZE:
+                connection.executemany("INSERT OR REPLACE INTO crossref_snapshot VALUES (?, ?, ?)", rows)
+                indexed += len(rows)
+                rows = []
+        print(f"{path}: {indexed + len(rows)} works indexed")
+
+    connection.executemany("INSERT OR REPLACE INTO crossref_snapshot VALUES (?, ?, ?)", rows)
+    indexed += len(rows)
+    connection.commit()
+    connection.close()
+    return indexed
+
+
+class CrossrefSnapshot:
+
+    """
+    Read-only lookups against an index built by build_index
+    """
+
+    def __init__(self, index_path: str):
+        if not os.path.isfile(index_path):
+            raise FileNotFoundError(f"Crossref snapshot index {index_path} does not exist")
+        self.connection = sqlite3.connect(f"file:{index_path}?mode=ro", uri = True, check_same_thread = False)
+        self.connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get_many(self, dois: list) -> dict:
+
+        """
+        Returns a dictionary keyed by DOI with the same CrossRef data as get_crossref_license_date for every DOI in the index
+        """
+
+        keys = {}
+        for doi in dois:
+            keys.setdefault(normalize_doi(doi), []).append(doi)
+
+        found = {}
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT doi, work FROM crossref_snapshot WHERE doi IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for key, work in rows:
+                response_dict = parse_crossref_work(json.loads(work))
+                for doi in keys[key]:
+                    found[doi] = response_dict
+
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(dois) - len(found)
+        return found
+
+    def close(self):
+        self.connection.close()
+
+
+def main(argv: list = None):
+
+    """
+    Command line entry point for building an index
+    """
+
+    parser = argparse.ArgumentParser(description = "Build a local Crossref index from a public data file or JSON lines dump.")
+    parser.add_argument("source", help = "dump file or directory of dump files")
+    parser.add_argument("index", help = "SQLite index file to create or add to")
+    parser.add_argument("--csv", help = "only index the DOIs in this CSV file")
+    parser.add_argument("--doi-col", default = "DOI", help = "name of the DOI column in the CSV file")
+    parser.add_argument("--uuid-col", default = "UUID", help = "name of the UUID column in the CSV file")
+    args = parser.parse_args(argv)
+
+    only_dois = None
+    if args.csv is not None:
+        only_dois = {doi for uuid, doi in read_records(args.csv, args.doi_col, args.uuid_col) if doi is not None}
+
+    indexed = build_index(args.source, args.index, only_dois)
+    print(f"{indexed} works were indexed in {args.index}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import requests as re
+import multiprocessing
+import random
+import threading
+import time
+import run_log
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+
+'''
+Shared HTTP layer for the Pure and Crossref requests. Every host gets one pooled session, so connections are kept alive and
+reused instead of opening a new TCP and TLS connection for each call. Failed requests are retried with exponential backoff and
+jitter, and each host is throttled to the rate it advertises (Crossref's X-Rate-Limit-* headers) or asks for (Retry-After).
+'''
+
+MAX_RETRIES = 3
+RETRY_BUDGET = 500
+POOL_SIZE = 16
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+THROTTLE_FLOOR = 0.05
+THROTTLE_CAP = 2.0
+
+'''
+GET requests are retried for any of these statuses. PUT requests are only retried when the server did not process the request
+(429 and 503) or the connection attempt itself timed out, because a PUT that failed later may already have been written to Pure.
+POST requests are only sent to Pure's search endpoint, which changes nothing, so they are retried like GET requests.
+'''
+
+RETRY_STATUSES = {"GET": {429, 500, 502, 503, 504}, "POST": {429, 500, 502, 503, 504}, "PUT": {429, 503}}
+READ_METHODS = {"GET", "POST"}
+
+hosts = {}
+hosts_lock = threading.Lock()
+
+'''
+Rate limits shared with other processes, keyed by host (see SharedRateLimit). They are set with share_rate_limit before the
+host is first used.
+'''
+
+shared_rate_limits = {}
+
+
+class SharedRateLimit:
+
+    """
+    Minimum spacing between requests to one host, shared by several processes (e.g. the shards of shard_runner.py) so that
+    together they stay within the host's quota. It has to be created before the processes are started and handed to them.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_request = multiprocessing.Value("d", 0.0, lock = False)
+        self.lock = multiprocessing.Lock()
+
+    def wait(self):
+
+        """
+        Blocks until this process may send the next request
+        """
+
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next_request.value)
+            self.next_request.value = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+    def defer(self, delay: float):
+
+        """
+        Holds back every process's next request for a server supplied delay
+        """
+
+        with self.lock:
+            self.next_request.value = max(self.next_request.value, time.time() + delay)
+
+
+def share_rate_limit(host: str, rate_limit: SharedRateLimit):
+
+    """
+    Makes every request to a host in this process wait for a rate limit shared with other processes
+    """
+
+    with hosts_lock:
+        shared_rate_limits[host] = rate_limit
+        if host in hosts:
+            hosts[host]["shared_rate_limit"] = rate_limit
+
+
+def configure_host(host: str, max_retries: int = MAX_RETRIES, retry_budget: int = RETRY_BUDGET, pool_size: int = POOL_SIZE):
+
+    """
+    Sets the retry limits and connection pool size for a host. max_retries applies to every single request and retry_budget
+    is the total number of retries allowed for the host over the whole run.
+    """
+
+    with hosts_lock:
+        if host in hosts:
+            hosts[host]["session"].close()
+        hosts[host] = new_host(max_retries, retry_budget, pool_size, shared_rate_limits.get(host))
+
+
+def new_host(max_retries: int, retry_budget: int, pool_size: int, shared_rate_limit: SharedRateLimit = None) -> dict:
+
+    """
+    Returns the pooled session and throttling state for a host
+    """
+
+    session = re.Session()
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return {
+        "session": session,
+        "max_retries": max_retries,
+        "retry_budget": retry_budget,
+        "min_interval": 0.0,
+        "advertised_interval": 0.0,
+        "next_request": 0.0,
+        "lock": threading.Lock(),
+        "shared_rate_limit": shared_rate_limit,
+    }
+
+
+def get_host(url: str) -> dict:
+
+    """
+    Returns the state for the host of a URL, creating it with the default limits if the host has not been configured
+    """
+
+    host = urlparse(url).netloc
+    with hosts_lock:
+        if host not in hosts:
+            hosts[host] = new_host(MAX_RETRIES, RETRY_BUDGET, POOL_SIZE, shared_rate_limits.get(host))
+        return hosts[host]
+
+
+def wait_for_slot(host: dict):
+
+    """
+    Blocks until the host's rate limit (and the rate limit shared with other processes, if there is one) allows another request
+    to be sent
+    """
+
+    with host["lock"]:
+        now = time.monotonic()
+        start = max(now, host["next_request"])
+        host["next_request"] = start + host["min_interval"]
+    if start > now:
+        time.sleep(start - now)
+    if host["shared_rate_limit"] is not None:
+        host["shared_rate_limit"].wait()
+
+
+def update_rate_limit(host: dict, response):
+
+    """
+    Adjusts the spacing between requests to a host. Crossref's X-Rate-Limit-Limit and X-Rate-Limit-Interval headers set the
+    advertised rate. A 429 response without a Retry-After header doubles the spacing and every successful response lets it
+    relax back towards the advertised rate.
+    """
+
+    limit = response.headers.get("X-Rate-Limit-Limit")
+    interval = response.headers.get("X-Rate-Limit-Interval")
+    advertised_interval = None
+    if limit is not None and interval is not None:
+        try:
+            advertised_interval = float(interval.rstrip("s")) / int(limit)
+        except (ValueError, ZeroDivisionError):
+            pass
+
+    with host["lock"]:
+        if advertised_interval is not None:
+            host["advertised_interval"] = advertised_interval
+        if response.status_code == 429 and "Retry-After" not in response.headers:
+            host["min_interval"] = min(max(host["min_interval"] * 2, THROTTLE_FLOOR), THROTTLE_CAP)
+        elif response.status_code < 400:
+            host["min_interval"] = host["min_interval"] * 0.8
+        if host["min_interval"] < max(host["advertised_interval"], THROTTLE_FLOOR / 10):
+            host["min_interval"] = host["advertised_interval"]
+
+
+def retry_after(response) -> float:
+
+    """
+    Returns the number of seconds a Retry-After header asks for, or None if there is no usable header
+    """
+
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def use_retry(host: dict, attempt: int) -> bool:
+
+    """
+    Returns True and takes one retry from the host's budget if another attempt is allowed
+    """
+
+    with host["lock"]:
+        if attempt >= host["max_retries"] or host["retry_budget"] <= 0:
+            return False
+        host["retry_budget"] -= 1
+        return True
+
+
+def backoff(host: dict, attempt: int, delay: float = None):
+
+    """
+    Sleeps before the next attempt. Without a server supplied delay this is exponential backoff with full jitter. A server
+    supplied delay is also applied to every other request to the same host.
+    """
+
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    else:
+        with host["lock"]:
+            host["next_request"] = max(host["next_request"], time.monotonic() + delay)
+        if host["shared_rate_limit"] is not None:
+            host["shared_rate_limit"].defer(delay)
+    time.sleep(delay)
+
+
+def request(method: str, url: str, stage: str = None, **kwargs):
+
+    """
+    Sends a request through the pooled session for the URL's host, retrying transient failures. The returned response has a
+    "retries" attribute with the number of retries that were needed. The last exception is raised if every attempt failed.
+    The request is recorded in the run log under the given stage (or the host name if no stage is given).
+    """
+
+    host = get_host(url)
+    retry_statuses = RETRY_STATUSES.get(method.upper(), RETRY_STATUSES["PUT"])
+    attempt = 0
+    started = time.monotonic()
+
+    while True:
+        wait_for_slot(host)
+        try:
+            response = host["session"].request(method, url, **kwargs)
+        except (re.exceptions.ConnectionError, re.exceptions.Timeout) as err:
+            retryable = method.upper() in READ_METHODS or isinstance(err, re.exceptions.ConnectTimeout)
+            if not retryable or not use_retry(host, attempt):
+                run_log.log_request(stage or urlparse(url).netloc, method, url, None, time.monotonic() - started, attempt,
+                                    type(err).__name__)
+                raise
+            backoff(host, attempt)
+            attempt += 1
+            continue
+
+        update_rate_limit(host, response)
+        if response.status_code in retry_statuses and use_retry(host, attempt):
+            backoff(host, attempt, retry_after(response))
+            attempt += 1
+            continue
+
+        response.retries = attempt
+        run_log.log_request(stage or urlparse(url).netloc, method, response.url, response.status_code,
+                            time.monotonic() - started, attempt)
+        return response
+
+
+def get(url: str, stage: str = None, **kwargs):
+
+    """
+    Sends a GET request through the shared client
+    """
+
+    return request("GET", url, stage, **kwargs)
+
+
+def put(url: str, stage: str = None, **kwargs):
+
+    """
+    Sends a PUT request through the shared client
+    """
+
+    return request("PUT", url, stage, **kwargs)
+
+
+def post(url: str, stage: str = None, **kwargs):
+
+    """
+    Sends a POST request (a search, see RETRY_STATUSES) through the shared client
+    """
+
+    return request("POST", url, stage, **kwargs)
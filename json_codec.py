@@ -0,0 +1,35 @@
+import json
+
+'''
+JSON encoding and decoding for request and response bodies. orjson is used when it is installed because it is several times
+faster than the standard library for the large research output records Pure returns; it is optional and everything works
+the same without it.
+'''
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value) -> bytes:
+
+    """
+    Returns the compact UTF-8 encoded JSON for a value
+    """
+
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators = (",", ":"), ensure_ascii = False).encode("utf-8")
+
+
+def loads(content: bytes):
+
+    """
+    Returns the value of a JSON response body. The raw bytes are decoded directly, which skips the character set detection
+    that response.json() runs on every response.
+    """
+
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
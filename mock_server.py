@@ -0,0 +1,305 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+'''
+Local stand-in for the Pure research output API and the Crossref REST API, used by benchmark.py to measure the updater without
+touching production Pure or the live Crossref API. Pure and Crossref are served on separate ports so that each gets its own
+connection pool and throttling state in the updater, just as the real hosts do.
+
+Records are generated from a hash of the UUID or DOI, so every run sees the same data without any setup:
+* Pure GET /<uuid> returns a research output with a published status and, for some records, an existing e-pub date. Records
+  written with PUT are kept in memory and returned by later GETs, so a second run finds them up to date. POST /search with a
+  {"uuids": [...], "size": ..., "offset": ..., "fields": [...]} body returns a page of the same records.
+* Crossref GET /works/<doi>/agency, /works/<doi> and /works?filter=doi:...,doi:... return works with a CC license (some of them
+  starting in the future, i.e. embargoed) and/or a published-online date. A share of DOIs is registered with another agency,
+  and a share counts as updated today for the from-update-date filter; all others were last updated in 2020.
+
+Latency, server errors and 429 responses (with a Retry-After header) can be configured, and the number of requests to each
+endpoint is returned by GET /_stats on either port. POST /_reset clears the counters and the stored Pure records.
+'''
+
+PURE_PORT = 8701
+CROSSREF_PORT = 8702
+LATENCY_MS = 20
+JITTER_MS = 5
+
+
+class MockState:
+
+    """
+    Settings, request counters and stored Pure records shared by both servers
+    """
+
+    def __init__(self, latency_ms: float = LATENCY_MS, jitter_ms: float = JITTER_MS, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 0.1, non_crossref_rate: float = 0.05, update_rate: float = 0.02):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.non_crossref_rate = non_crossref_rate
+        self.update_rate = update_rate
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.records = {}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def fraction(key: str) -> float:
+
+    """
+    Returns a number in [0, 1) that is always the same for the same key
+    """
+
+    return zlib.crc32(key.encode("utf-8")) / 2 ** 32
+
+
+def pure_record(uuid: str) -> dict:
+
+    """
+    Returns the generated research output for a UUID
+    """
+
+    share = fraction(uuid)
+    statuses = [{
+        "publicationStatus": {"uri": "/dk/atira/pure/researchoutput/status/published", "term": {"en_US": "Published"}},
+        "publicationDate": {"year": 2018 + int(share * 6), "month": 1 + int(share * 120) % 12},
+    }]
+    if share < 0.25:
+        statuses.append({
+            "publicationStatus": {"uri": "/dk/atira/pure/researchoutput/status/epub", "term": {"en_US": "E-pub ahead of print"}},
+            "publicationDate": {"year": 2018, "month": 3, "day": 9},
+        })
+    return {
+        "uuid": uuid,
+        "version": "1",
+        "title": {"value": f"Research output {uuid}"},
+        "electronicVersions": [{
+            "accessType": {"uri": "/dk/atira/pure/core/openaccesspermission/unknown", "term": {"en_US": "Unknown"}},
+        }],
+        "publicationStatuses": statuses,
+    }
+
+
+def crossref_work(doi: str) -> dict:
+
+    """
+    Returns the generated Crossref work record for a DOI
+    """
+
+    share = fraction(doi)
+    work = {"DOI": doi}
+    if share < 0.6:
+        start_year = 2030 if share < 0.05 else 2019
+        work["license"] = [
+            {"content-version": "tdm", "URL": "https://www.elsevier.com/tdm/userlicense/1.0/", "start": {"date-parts": [[2019, 1, 1]]}},
+            {"content-version": "vor", "URL": "http://creativecommons.org/licenses/by/4.0/", "start": {"date-parts": [[start_year, 1, 1]]}},
+        ]
+    if share > 0.3:
+        work["published-online"] = {"date-parts": [[2017, 1 + int(share * 1000) % 12, 1 + int(share * 10000) % 28]]}
+    return work
+
+
+def agency(doi: str, state: MockState) -> str:
+    return "datacite" if fraction("agency:" + doi) < state.non_crossref_rate else "crossref"
+
+
+def updated_on(doi: str, state: MockState) -> str:
+    return date.today().strftime("%Y-%m-%d") if fraction("updated:" + doi) < state.update_rate else "2020-01-01"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    """
+    Request handler shared by the Pure and Crossref servers; the server's "api" attribute tells which API it stands in for
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, value, headers: dict = None):
+        body = json.dumps(value, separators = (",", ":")).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(body)))
+        for name, header in (headers or {}).items():
+            self.send_header(name, header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def simulate(self) -> bool:
+
+        """
+        Waits for the configured latency and sends a 429 or 500 response when one is due. Returns False if a response was sent.
+        """
+
+        state = self.server.state
+        delay = state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        chance = random.random()
+        if chance < state.throttle_rate:
+            state.count(f"{self.server.api}_429")
+            self.send_json(429, {"message": "Too many requests"}, {"Retry-After": str(state.retry_after)})
+            return False
+        if chance < state.throttle_rate + state.error_rate:
+            state.count(f"{self.server.api}_500")
+            self.send_json(500, {"message": "Internal server error"})
+            return False
+        return True
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        path = urlparse(self.path).path
+        if path == "/_reset":
+            state.reset()
+            return self.send_json(200, {})
+        if self.server.api != "pure" or not path.endswith("/search"):
+            return self.send_json(404, {"message": "Not found"})
+        if not self.simulate():
+            return
+
+        state.count("pure_search")
+        query = json.loads(body or b"{}")
+        uuids = query.get("uuids") or []
+        offset = query.get("offset", 0)
+        fields = {field.split(".")[0] for field in query.get("fields") or []}
+        items = []
+        with state.lock:
+            for uuid in uuids[offset:offset + query.get("size", 10)]:
+                record = state.records.get(uuid) or pure_record(uuid)
+                if fields:
+                    record = {key: value for key, value in record.items() if key in fields}
+                items.append(record)
+        self.send_json(200, {"count": len(uuids), "pageInformation": {"offset": offset, "size": len(items)}, "items": items})
+
+    def do_GET(self):
+        state = self.server.state
+        parsed = urlparse(self.path)
+        path = unquote(parsed.path)
+        if path == "/_stats":
+            with state.lock:
+                return self.send_json(200, dict(state.counts))
+
+        if not self.simulate():
+            return
+
+        if self.server.api == "pure":
+            state.count("pure_get")
+            uuid = path.strip("/").rsplit("/", 1)[-1]
+            with state.lock:
+                record = state.records.get(uuid)
+            return self.send_json(200, record if record is not None else pure_record(uuid))
+
+        if path == "/works":
+            state.count("crossref_filter")
+            filters = parse_qs(parsed.query).get("filter", [""])[0].split(",")
+            dois = [part[len("doi:"):].lower() for part in filters if part.startswith("doi:")]
+            since = [part[len("from-update-date:"):] for part in filters if part.startswith("from-update-date:")]
+            items = [crossref_work(doi) for doi in dois
+                     if agency(doi, state) == "crossref" and (not since or updated_on(doi, state) >= since[0])]
+            return self.send_json(200, {"status": "ok", "message": {"items": items}})
+        if path.startswith("/works/") and path.endswith("/agency"):
+            state.count("crossref_agency")
+            doi = path[len("/works/"):-len("/agency")]
+            return self.send_json(200, {"status": "ok", "message": {"DOI": doi, "agency": {"id": agency(doi, state)}}})
+        if path.startswith("/works/"):
+            state.count("crossref_works")
+            doi = path[len("/works/"):]
+            if agency(doi, state) != "crossref":
+                return self.send_json(404, {"message": "Resource not found."})
+            return self.send_json(200, {"status": "ok", "message": crossref_work(doi)})
+        self.send_json(404, {"message": "Not found"})
+
+    def do_PUT(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        if self.server.api != "pure":
+            return self.send_json(405, {"message": "Method not allowed"})
+        if not self.simulate():
+            return
+
+        state.count("pure_put")
+        uuid = unquote(urlparse(self.path).path).strip("/").rsplit("/", 1)[-1]
+        values = json.loads(body)
+        with state.lock:
+            record = state.records.get(uuid) or pure_record(uuid)
+            if values.get("version") != record["version"]:
+                state.counts["pure_conflict"] = state.counts.get("pure_conflict", 0) + 1
+                return self.send_json(409, {"message": "The version does not match the current version"})
+            record.update({key: value for key, value in values.items() if key != "version"})
+            record["version"] = str(int(record["version"]) + 1)
+            state.records[uuid] = record
+        self.send_json(200, record)
+
+
+def start(state: MockState, pure_port: int = PURE_PORT, crossref_port: int = CROSSREF_PORT, host: str = "127.0.0.1") -> list:
+
+    """
+    Starts the Pure and Crossref servers in background threads and returns them
+    """
+
+    servers = []
+    for api, port in (("pure", pure_port), ("crossref", crossref_port)):
+        server = ThreadingHTTPServer((host, port), MockHandler)
+        server.daemon_threads = True
+        server.api = api
+        server.state = state
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        servers.append(server)
+    return servers
+
+
+def main(argv: list = None):
+
+    """
+    Command line entry point for running the servers on their own
+    """
+
+    parser = argparse.ArgumentParser(description = "Serve stand-ins for the Pure research output API and the Crossref API.")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--pure-port", type = int, default = PURE_PORT)
+    parser.add_argument("--crossref-port", type = int, default = CROSSREF_PORT)
+    parser.add_argument("--latency-ms", type = float, default = LATENCY_MS, help = "average time taken by every request")
+    parser.add_argument("--jitter-ms", type = float, default = JITTER_MS, help = "random variation of the latency")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "share of requests answered with a 500 error")
+    parser.add_argument("--throttle-rate", type = float, default = 0.0, help = "share of requests answered with a 429 error")
+    parser.add_argument("--retry-after", type = float, default = 0.1, help = "Retry-After value (seconds) sent with a 429 error")
+    parser.add_argument("--non-crossref-rate", type = float, default = 0.05,
+                        help = "share of DOIs registered with an agency other than Crossref")
+    parser.add_argument("--update-rate", type = float, default = 0.02,
+                        help = "share of DOIs whose Crossref metadata counts as updated today")
+    args = parser.parse_args(argv)
+
+    state = MockState(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate, args.retry_after,
+                      args.non_crossref_rate, args.update_rate)
+    servers = start(state, args.pure_port, args.crossref_port, args.host)
+    print(f"Pure: http://{args.host}:{args.pure_port}/ws/api/research-outputs/")
+    print(f"Crossref: http://{args.host}:{args.crossref_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
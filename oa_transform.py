@@ -0,0 +1,322 @@
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+from pathlib import PurePosixPath
+from urllib.parse import unquote, urlparse
+
+'''
+Pure decision logic for turning harvested Crossref data into changes to a Pure research output. Nothing in this module makes
+requests or writes files, so it can be tested and timed on its own.
+
+Crossref and Pure dates are handled as PartialDate tuples of integers, where month and day are None when the source only has
+a year or a year and month. They are ordered as the first day of the missing period, which is how the dates used to be compared
+after parsing them with datetime.strptime.
+'''
+
+PartialDate = namedtuple("PartialDate", ["year", "month", "day"])
+
+OPEN_ACCESS = ("/dk/atira/pure/core/openaccesspermission/open", "Open")
+EMBARGOED_ACCESS = ("/dk/atira/pure/core/openaccesspermission/embargoed", "Embargoed")
+
+PUBLISHED_STATUS = "/dk/atira/pure/researchoutput/status/published"
+EPUB_STATUS = "/dk/atira/pure/researchoutput/status/epub"
+
+'''
+Creative Commons license codes (the part of the license URL after /licenses/ or /publicdomain/) and the Pure license type
+each one is written as. Codes not in this table are written as "Other".
+'''
+
+LICENSE_TYPES = {
+    "by": ("/dk/atira/pure/core/document/licenses/cc_by", "CC BY"),
+    "by-sa": ("/dk/atira/pure/core/document/licenses/cc_by_sa", "CC BY-SA"),
+    "by-nc": ("/dk/atira/pure/core/document/licenses/cc_by_nc", "CC BY-NC"),
+    "by-nc-sa": ("/dk/atira/pure/core/document/licenses/cc_by_nc_sa", "CC BY-NC-SA"),
+    "by-nd": ("/dk/atira/pure/core/document/licenses/cc_by_nd", "CC BY-ND"),
+    "by-nc-nd": ("/dk/atira/pure/core/document/licenses/cc_by_nc_nd", "CC BY-NC-ND"),
+    "zero": ("/dk/atira/pure/core/document/licenses/cc0", "CC0"),
+    "cc0": ("/dk/atira/pure/core/document/licenses/cc0", "CC0"),
+    "mark": ("/dk/atira/pure/core/document/licenses/cc_pdm", "CC PDM"),
+}
+OTHER_LICENSE = ("/dk/atira/pure/core/document/licenses/other", "Other")
+
+
+def partial_date(parts: list) -> PartialDate:
+
+    """
+    Returns the PartialDate for a list of year, month and day values (month and day may be missing), or None if they do not make
+    up a valid date
+    """
+
+    numbers = []
+    for part in parts[:3]:
+        if part is None:
+            break
+        try:
+            numbers.append(int(part))
+        except (TypeError, ValueError):
+            break
+    if not numbers:
+        return None
+    numbers += [None, None]
+    result = PartialDate(numbers[0], numbers[1], numbers[2])
+    try:
+        to_date(result)
+    except ValueError:
+        return None
+    return result
+
+
+def date_from_parts(date_parts: list) -> PartialDate:
+
+    """
+    Returns the PartialDate for a Crossref "date-parts" value such as [[2020, 5, 3]], or None if it holds no usable year (e.g.
+    [[null]])
+    """
+
+    if not date_parts or not date_parts[0]:
+        return None
+    return partial_date(date_parts[0])
+
+
+def date_from_string(date_string: str) -> PartialDate:
+
+    """
+    Returns the PartialDate for a date in the "2020, 5, 3" form the Crossref cache stores dates in, or None if it is not a valid
+    date
+    """
+
+    return partial_date(date_string.split(","))
+
+
+def date_to_string(partial: PartialDate) -> str:
+
+    """
+    Returns a PartialDate in the "2020, 5, 3" form the Crossref cache stores dates in
+    """
+
+    return ", ".join(str(part) for part in partial if part is not None)
+
+
+def date_from_pure(publication_date: dict) -> PartialDate:
+
+    """
+    Returns the PartialDate for a Pure publicationDate object, or None if it holds no year
+    """
+
+    if publication_date is None or "year" not in publication_date:
+        return None
+    year = int(publication_date["year"])
+    if "month" not in publication_date:
+        return PartialDate(year, None, None)
+    month = int(publication_date["month"])
+    if "day" not in publication_date:
+        return PartialDate(year, month, None)
+    return PartialDate(year, month, int(publication_date["day"]))
+
+
+def to_date(partial_date: PartialDate) -> date:
+
+    """
+    Returns the first day of the period a PartialDate covers
+    """
+
+    return date(partial_date.year, partial_date.month or 1, partial_date.day or 1)
+
+
+def embargo_end(license_start: PartialDate, today: date) -> str:
+
+    """
+    Returns the embargo end date (YYYY-MM-DD) if a license only starts after today, otherwise None
+    """
+
+    if license_start is None:
+        return None
+    start = to_date(license_start)
+    if start > today:
+        return start.strftime("%Y-%m-%d")
+    return None
+
+
+@lru_cache(maxsize = 1024)
+def license_for_url(license_url: str) -> tuple:
+
+    """
+    Returns the Pure (uri, term) for a Creative Commons license URL, or None if the URL is not a Creative Commons license
+    """
+
+    parsed = urlparse(license_url)
+    if parsed.netloc != "creativecommons.org":
+        return None
+    parts = PurePosixPath(unquote(parsed.path)).parts
+    if len(parts) < 3:
+        return OTHER_LICENSE
+    return LICENSE_TYPES.get(parts[2].lower(), OTHER_LICENSE)
+
+
+def plan_update(crossref_dict: dict) -> dict:
+
+    """
+    Returns the changes the harvested Crossref data for one DOI calls for: the Pure license type, access type and embargo end
+    date for a Creative Commons license, and the e-pub date
+    """
+
+    plan = {"license": None, "access": None, "embargo": None, "epub": None}
+
+    if crossref_dict["license"] is not None:
+        license_type = license_for_url(crossref_dict["license"])
+        if license_type is not None:
+            plan["license"] = license_type
+            if crossref_dict["embargo"] is not None:
+                plan["access"] = EMBARGOED_ACCESS
+                plan["embargo"] = crossref_dict["embargo"]
+            else:
+                plan["access"] = OPEN_ACCESS
+
+    '''
+    A date that is not a valid date counts as no e-pub date, so one bad Crossref record cannot stop a whole batch.
+    '''
+
+    epub = crossref_dict["date"]
+    if isinstance(epub, str):
+        epub = date_from_string(epub)
+    plan["epub"] = epub
+
+    return plan
+
+
+def plan_updates(crossref_dicts: dict) -> dict:
+
+    """
+    Returns a dictionary keyed by DOI with the plan_update result for every harvested result in a batch
+    """
+
+    return {doi: plan_update(crossref_dict) for doi, crossref_dict in crossref_dicts.items()}
+
+
+def canonical(value):
+
+    """
+    Returns a copy of a JSON value with every number turned into a string, so that values read from Pure (e.g. a year of 2020)
+    compare equal to the same values built from Crossref data (a year of "2020")
+    """
+
+    if isinstance(value, dict):
+        return {key: canonical(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [canonical(item) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+def print_publication_date(publication_statuses: list) -> PartialDate:
+
+    """
+    Returns the date of the last "published" status of a Pure record, or None if it has none
+    """
+
+    print_date = None
+    for publication_status in publication_statuses:
+        if publication_status.get("publicationStatus").get("uri") == PUBLISHED_STATUS:
+            print_date = date_from_pure(publication_status["publicationDate"])
+    return print_date
+
+
+def new_epub_status(epub: PartialDate) -> dict:
+
+    """
+    Returns a new "E-pub ahead of print" publication status for a date
+    """
+
+    publication_date = {"year": str(epub.year)}
+    if epub.month is not None:
+        publication_date["month"] = str(epub.month)
+        if epub.day is not None:
+            publication_date["day"] = str(epub.day)
+
+    epub_status = {
+        "publicationStatus": {
+            "uri": EPUB_STATUS,
+            "term": {
+                "en_US": "E-pub ahead of print"
+            }
+        },
+        "publicationDate": publication_date
+    }
+    if epub.day is None:
+        epub_status = {"current": "false", **epub_status}
+    return epub_status
+
+
+def apply_plan(electronic_versions: list, publication_statuses: list, plan: dict) -> dict:
+
+    """
+    Writes a plan into the electronic versions and publication statuses of a Pure record (in place) and returns which of the
+    two sections actually changed, whether the plan proposed any change at all, and whether a license could not be written
+    because the record has no electronic version
+    """
+
+    changed = {"proposed": False, "license": False, "epub": False, "no_electronic_version": False}
+
+    '''
+    An e-pub date that is later than the print publication date causes errors in Pure, so it is not written in that case.
+    '''
+
+    epub = plan["epub"]
+    if epub is not None:
+        print_date = print_publication_date(publication_statuses)
+        if print_date is not None and to_date(epub) > to_date(print_date):
+            epub = None
+
+    '''
+    For a Creative Commons license, set the OA status to "Embargoed" with an embargo end date on the day the license begins if that
+    is later than today, otherwise to "Open", and write the license type. A record without an electronic version (e.g. a
+    metadata-only output) has nowhere to hold them, so the license is left out and reported instead of raising, and one such
+    record cannot stop a whole batch.
+    '''
+
+    if plan["license"] is not None and not electronic_versions:
+        changed["no_electronic_version"] = True
+    elif plan["license"] is not None:
+        changed["proposed"] = True
+        current = canonical(electronic_versions[:1])
+        electronic_version = electronic_versions[0]
+        access_type = electronic_version.setdefault("accessType", {})
+        access_type["uri"] = plan["access"][0]
+        access_type.setdefault("term", {})["en_US"] = plan["access"][1]
+        if plan["embargo"] is not None:
+            electronic_version["embargoPeriod"] = {"endDate": plan["embargo"]}
+        electronic_version["licenseType"] = {
+            "uri": plan["license"][0],
+            "term": {
+                "en_US": plan["license"][1],
+            }
+        }
+        changed["license"] = canonical(electronic_versions[:1]) != current
+
+    '''
+    If there is an existing e-pub date in Pure, overwrite its values with the Crossref data, clearing a day or month that Crossref
+    does not have. If there is not, add a new publication status.
+    '''
+
+    if epub is not None:
+        changed["proposed"] = True
+        current = canonical(publication_statuses)
+        for publication_status in publication_statuses:
+            if publication_status.get("publicationStatus").get("uri") == EPUB_STATUS:
+                publication_date = publication_status["publicationDate"]
+                publication_date["year"] = str(epub.year)
+                if epub.month is not None:
+                    publication_date["month"] = str(epub.month)
+                elif "month" in publication_date:
+                    publication_date["month"] = "null"
+                if epub.day is not None:
+                    publication_date["day"] = str(epub.day)
+                elif "day" in publication_date:
+                    publication_date["day"] = "null"
+                break
+        else:
+            publication_statuses.append(new_epub_status(epub))
+        changed["epub"] = canonical(publication_statuses) != current
+
+    return changed
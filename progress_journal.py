@@ -0,0 +1,86 @@
+import json
+import os
+from datetime import datetime
+
+'''
+Outcomes recorded for each research output. Records that were skipped (no new data), already up to date (Pure already held
+the Crossref data) or updated are complete; records with a get-error, put-error or crossref-error (the Crossref lookup of
+the DOI failed for a transient reason, so it is not known whether there is new data) still need work and are run again by a
+resumed run. A DOI that Crossref does not know is a final answer, so its record is skipped rather than failed.
+'''
+
+SKIPPED = "skipped"
+UPDATED = "updated"
+UP_TO_DATE = "up-to-date"
+GET_ERROR = "get-error"
+PUT_ERROR = "put-error"
+CROSSREF_ERROR = "crossref-error"
+
+COMPLETED_OUTCOMES = {SKIPPED, UP_TO_DATE, UPDATED}
+FAILED_OUTCOMES = {GET_ERROR, PUT_ERROR, CROSSREF_ERROR}
+
+
+def load_journal(path: str) -> dict:
+
+    """
+    Returns a dictionary with the latest outcome for every UUID recorded since the last fresh (not resumed) run
+    """
+
+    outcomes = {}
+    if not os.path.isfile(path):
+        return outcomes
+
+    with open(path, "r", encoding = "utf-8") as journal_file:
+        for line in journal_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                '''
+                A run that was killed while writing can leave a partial last line behind. It is ignored and that record
+                is treated as not yet processed.
+                '''
+                continue
+            if entry.get("event") == "start":
+                if not entry.get("resume"):
+                    outcomes = {}
+                continue
+            outcomes[entry["uuid"]] = entry["outcome"]
+
+    return outcomes
+
+
+class ProgressJournal:
+
+    """
+    Append-only JSON lines file recording the outcome of every processed research output
+    """
+
+    def __init__(self, path: str, resume: bool):
+        self.path = path
+        self.journal_file = open(path, "a", encoding = "utf-8")
+        self.write({"event": "start", "resume": resume, "time": datetime.now().isoformat(timespec = "seconds")})
+        self.sync()
+
+    def write(self, entry: dict):
+        self.journal_file.write(json.dumps(entry) + "\n")
+
+    def record(self, uuid: str, doi: str, outcome: str):
+
+        """
+        Appends the outcome for one research output
+        """
+
+        self.write({"uuid": uuid, "doi": doi, "outcome": outcome})
+
+    def sync(self):
+
+        """
+        Flushes recorded outcomes to disk so they survive a crash
+        """
+
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+
+    def close(self):
+        self.sync()
+        self.journal_file.close()
@@ -0,0 +1,727 @@
+import requests as re
+import http_client
+from tqdm import tqdm
+import json_codec
+import crossref_data_harvester
+from crossref_data_harvester import get_crossref_license_dates, get_crossref_updates
+import crossref_cache
+from crossref_cache import CrossrefCache
+from crossref_snapshot import CrossrefSnapshot
+from record_reader import count_rows, read_records
+import progress_journal
+from progress_journal import ProgressJournal
+import sync_state
+from sync_state import SyncState
+import oa_transform
+import run_log
+from urllib.parse import urlparse
+import os
+import argparse
+import configparser
+import itertools
+import threading
+import time
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Default settings. Each of these can be changed with a command line option or in a config file (see parse_args).
+
+Concurrency limits. RECORD_WORKERS is the number of research outputs processed at the same time. PURE_CONCURRENCY and
+CROSSREF_CONCURRENCY cap the number of requests that may be in flight against each API at once, so that raising the number
+of workers never pushes more load onto Pure or Crossref than these limits allow.
+'''
+
+RECORD_WORKERS = 8
+PURE_CONCURRENCY = 4
+CROSSREF_CONCURRENCY = 2
+
+'''
+BATCH_SIZE is the number of CSV rows read and processed together. CROSSREF_BATCH_SIZE is the number of DOIs looked up in
+Crossref with one request to the works endpoint (instead of two requests per DOI); a batch of rows is split into chunks of this
+size. It is kept separate so that the batch can grow (e.g. to make use of --prefetch-size) without making the Crossref URL
+longer. Crossref returns at most MAX_CROSSREF_BATCH_SIZE works per request.
+'''
+
+BATCH_SIZE = 50
+CROSSREF_BATCH_SIZE = 50
+MAX_CROSSREF_BATCH_SIZE = 1000
+
+'''
+Crossref results are kept in a cache file in the error log folder so that later runs only ask Crossref about DOIs whose cached
+data has expired. Use --no-cache to always fetch fresh data.
+'''
+
+USE_CROSSREF_CACHE = True
+CROSSREF_CACHE_FILE = "crossref_cache.sqlite"
+
+'''
+The outcome of every research output is appended to a journal in the error log folder, so that an interrupted run can be
+resumed with --resume (skip everything already completed) or --retry-failures (only run records that failed last time).
+'''
+
+JOURNAL_FILE = "progress_journal.jsonl"
+
+'''
+Every request and every error of a run is written to a JSON lines run log in the error log folder (see run_log.py). The exit
+report summarizes the latency of each stage from it.
+'''
+
+RUN_LOG_FILE = "run_log.jsonl"
+
+'''
+With --incremental, the date of the last sync and the DOI and embargo end date of every processed research output are kept in
+this file in the error log folder, and later runs only process research outputs that are new, changed or have new Crossref data.
+'''
+
+SYNC_STATE_FILE = "sync_state.sqlite"
+
+'''
+With --prefetch, the research outputs of each batch are read with paged requests to the research output search endpoint
+instead of one GET request each, selecting only the fields the update needs. Records that are going to be written are requested
+once more right before the PUT, so that the version sent to Pure is current.
+'''
+
+PREFETCH_PAGE_SIZE = 100
+PREFETCH_FIELDS = ["uuid", "version", "electronicVersions.*", "publicationStatuses.*"]
+
+pure_slots = threading.BoundedSemaphore(PURE_CONCURRENCY)
+
+
+def set_pure_concurrency(limit: int):
+
+    """
+    Sets the maximum number of concurrent requests to the Pure API
+    """
+
+    global pure_slots
+    pure_slots = threading.BoundedSemaphore(limit)
+
+
+def get_record(uuid: str, url: str, get_headers: dict, stage: str = "pure_get") -> tuple:
+
+    """
+    Returns the research output for a UUID from a GET request and None, or None and the message of the failed request
+    """
+
+    get_response = None
+    try:
+        with pure_slots:
+            get_response = http_client.get(f"{url}{uuid}", stage, headers = get_headers, timeout = 10)
+        get_response.raise_for_status()
+    except re.exceptions.HTTPError as errh:
+        return None, "HTTP Error: " + str(errh) + '\n' + errh.response.text
+    except re.exceptions.ConnectionError as errc:
+        return None, "Error Connecting for url: " + f"{url}{uuid}" + "\n" + str(errc)
+    except re.exceptions.Timeout as errt:
+        return None, "Timeout error for url: " + f"{url}{uuid}" + "\n" + str(errt)
+    except re.exceptions.RequestException as err:
+        return None, "Something went wrong: " + str(err)
+    return json_codec.loads(get_response.content), None
+
+
+def prefetch_records(uuids: list, search_url: str, headers: dict, fields: list, page_size: int = PREFETCH_PAGE_SIZE) -> dict:
+
+    """
+    Returns a dictionary keyed by UUID with the research outputs found for a list of UUIDs through paged POST requests to the
+    research output search endpoint, selecting only the given fields. UUIDs that are not returned (including every UUID of a
+    page whose request failed) are left out, so that process_record falls back to a GET request for them. The UUID is always
+    selected, since the results are matched by it. Items that were not asked for are ignored, so a search endpoint that does
+    not apply the UUID filter costs at most one page per chunk instead of paging through the whole catalog.
+    """
+
+    records = {}
+    for start in range(0, len(uuids), page_size):
+        chunk = uuids[start:start + page_size]
+        wanted = set(chunk)
+        query = {"uuids": chunk, "size": len(chunk), "offset": 0}
+        if fields:
+            query["fields"] = fields if "uuid" in fields else ["uuid"] + fields
+
+        while True:
+            response = None
+            try:
+                with pure_slots:
+                    response = http_client.post(search_url, "pure_search", headers = headers, data = json_codec.dumps(query),
+                                                timeout = 30)
+                response.raise_for_status()
+            except re.exceptions.RequestException as err:
+                run_log.log("error", stage = "pure_search", uuids = chunk,
+                            message = "Prefetch failed, falling back to single GET requests: " + str(err))
+                break
+
+            page = json_codec.loads(response.content)
+            items = page.get("items") or []
+            for item in items:
+                if item.get("uuid") in wanted and "version" in item and "electronicVersions" in item and "publicationStatuses" in item:
+                    records[item["uuid"]] = item
+            query["offset"] += len(items)
+            if not items or query["offset"] >= min(page.get("count", 0), len(chunk)):
+                break
+
+    return records
+
+
+def plan_values(record: dict, plan: dict, result: dict) -> dict:
+
+    """
+    Writes the planned Crossref data into a research output and returns the PUT payload, or None if Pure already holds all of
+    it. Which sections changed is noted in the result of process_record.
+    """
+
+    values = {
+        "version": record.get("version"),
+    }
+
+    electronic_version = record.setdefault("electronicVersions", [])
+    publication_statuses = record["publicationStatuses"]
+
+    '''
+    Only the sections that end up different from what Pure already has are sent, so records that are already up to date are not
+    written again.
+    '''
+
+    changed = oa_transform.apply_plan(electronic_version, publication_statuses, plan)
+    result["license_updated"] = changed["license"]
+    result["epub_updated"] = changed["epub"]
+    result["no_electronic_version"] = changed["no_electronic_version"]
+    if changed["license"]:
+        values["electronicVersions"] = electronic_version
+    if changed["epub"]:
+        values["publicationStatuses"] = publication_statuses
+    changes = changed["license"] or changed["epub"]
+    result["up_to_date"] = changed["proposed"] and not changes
+
+    return values if changes else None
+
+
+def process_record(uuid, plan: dict, url: str, get_headers: dict, put_headers: dict, dry_run: bool = False,
+                   record: dict = None) -> dict:
+
+    """
+    Runs the GET -> PUT sequence for a single research output using the update planned from its harvested Crossref data and
+    returns a dictionary describing the outcome (including the message of a failed request, which the caller writes to the run
+    log). With dry_run the changes are worked out but no PUT request is made. A record that was already fetched with
+    prefetch_records is used in place of the GET request to decide whether a PUT is needed; the PUT itself is built from a fresh
+    copy requested right before it.
+    """
+
+    result = {"uuid": uuid, "get_error": None, "put_error": None, "crossref_error": False, "updated": False, "up_to_date": False,
+              "license_updated": False, "epub_updated": False, "no_electronic_version": False}
+
+    prefetched = record is not None
+    if not prefetched:
+        record, result["get_error"] = get_record(uuid, url, get_headers)
+        if record is None:
+            return result
+
+    values = plan_values(record, plan, result)
+
+    '''
+    A prefetched record only decides whether a PUT is needed. Pure replaces the electronic versions and publication statuses as
+    whole lists on a PUT and the prefetched copy may lack parts of them (depending on the field selection), so the payload is
+    always built from a fresh copy, which also carries the current version.
+    '''
+
+    if values is not None and prefetched and not dry_run:
+        fresh_record, result["get_error"] = get_record(uuid, url, get_headers, "pure_recheck")
+        if fresh_record is None:
+            return result
+        values = plan_values(fresh_record, plan, result)
+
+    '''
+    If any new data was found, make a PUT request to the appropriate Pure API instance and write said data into Pure. The payload
+    only holds the version and the sections that differ from what Pure already has, serialized without indentation.
+    '''
+
+    if values is not None and dry_run:
+        result["updated"] = True
+    elif values is not None:
+        put_response = None
+        try:
+            with pure_slots:
+                put_response = http_client.put(f"{url}{uuid}", "pure_put", headers=put_headers, data = json_codec.dumps(values),
+                                               timeout=10)
+            put_response.raise_for_status()
+        except re.exceptions.HTTPError as errh:
+            result["put_error"] = "HTTP Error: " + str(errh) + '\n' + errh.response.text
+        except re.exceptions.ConnectionError as errc:
+            result["put_error"] = "Error Connecting for url: " + f"{url}{uuid}" + "\n" + str(errc)
+        except re.exceptions.Timeout as errt:
+            result["put_error"] = "Timeout error for url: " + f"{url}{uuid}" + "\n" + str(errt)
+        except re.exceptions.RequestException as err:
+            result["put_error"] = "Something went wrong: " + str(err)
+        else:
+            result["updated"] = True
+
+    return result
+
+
+def record_outcome(result: dict) -> str:
+
+    """
+    Returns the journal outcome for the result of process_record. Only a Crossref lookup that failed for a transient reason is
+    a crossref-error; a DOI that Crossref does not know leaves no new data, so its record is skipped.
+    """
+
+    if result["get_error"] is not None:
+        return progress_journal.GET_ERROR
+    if result["put_error"] is not None:
+        return progress_journal.PUT_ERROR
+    if result["crossref_error"]:
+        return progress_journal.CROSSREF_ERROR
+    if result["updated"]:
+        return progress_journal.UPDATED
+    if result["up_to_date"]:
+        return progress_journal.UP_TO_DATE
+    return progress_journal.SKIPPED
+
+
+def clean_path(path: str) -> str:
+
+    """
+    Returns a path pasted from "Copy as path" without quotation marks and with forward slashes
+    """
+
+    return path.strip().strip("\"").replace("\\", "/")
+
+
+'''
+Settings that have to be known for every run. When one of them is not given on the command line, in the config file or (for
+the API key) in the PURE_API_KEY environment variable, the user is asked for it, just like when the program is run from an IDE.
+'''
+
+PROMPTS = {
+    "api_key": "Enter your API key: ",
+    "csv": "Enter path to file with CSV of research outputs to be updated: ",
+    "url": "Enter the URL for the research outputs endpoint of your Pure instance: ",
+    "doi_col": "Enter the name of the column in the csv file that contains the DOI for each output: ",
+    "uuid_col": "Enter the name of the column in the csv file that contains the UUID for each output: ",
+    "out_folder": "Enter a path where the program should place error logs: ",
+}
+
+BOOLEAN_SETTINGS = {"no_batch_lookup", "no_cache", "offline", "resume", "retry_failures", "dry_run", "no_progress", "incremental",
+                    "prefetch"}
+
+
+def shard_spec(value: str) -> tuple:
+
+    """
+    Returns the (index, shards) tuple for a --shard value such as 2/8, where the index counts from 1
+    """
+
+    try:
+        index, shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value!r} is not of the form INDEX/SHARDS, e.g. 2/8")
+    if shards < 1 or not 1 <= index <= shards:
+        raise argparse.ArgumentTypeError(f"shard {value!r} does not exist")
+    return index - 1, shards
+
+
+def build_parser() -> argparse.ArgumentParser:
+
+    """
+    Returns the parser for the command line options of a run
+    """
+
+    parser = argparse.ArgumentParser(description = "Write Crossref license and e-pub data into Pure research outputs.")
+    parser.add_argument("--config", help = "INI file with a [pure_updater] section holding any of the options below "
+                                           "(written with underscores, e.g. doi_col = DOI)")
+    parser.add_argument("--api-key", help = "Pure API key (defaults to the PURE_API_KEY environment variable)")
+    parser.add_argument("--csv", help = "CSV file of research outputs to be updated")
+    parser.add_argument("--url", help = "URL of the research outputs endpoint of the Pure API, ending in a slash")
+    parser.add_argument("--doi-col", help = "name of the CSV column holding the DOI")
+    parser.add_argument("--uuid-col", help = "name of the CSV column holding the UUID")
+    parser.add_argument("--out-folder", help = "folder for the run log, journal, cache and exit report")
+    parser.add_argument("--record-workers", type = int, default = RECORD_WORKERS,
+                        help = "number of research outputs processed at the same time")
+    parser.add_argument("--pure-concurrency", type = int, default = PURE_CONCURRENCY,
+                        help = "maximum number of Pure requests in flight at once")
+    parser.add_argument("--crossref-concurrency", type = int, default = CROSSREF_CONCURRENCY,
+                        help = "maximum number of Crossref requests in flight at once")
+    parser.add_argument("--batch-size", type = int, default = BATCH_SIZE,
+                        help = "number of CSV rows read and processed together")
+    parser.add_argument("--crossref-batch-size", type = int, default = CROSSREF_BATCH_SIZE,
+                        help = f"number of DOIs looked up in Crossref with one works request (at most {MAX_CROSSREF_BATCH_SIZE})")
+    parser.add_argument("--no-batch-lookup", action = "store_true",
+                        help = "look every DOI up in Crossref on its own instead of one works request per batch")
+    parser.add_argument("--crossref-url", default = crossref_data_harvester.CROSSREF_API,
+                        help = "base URL of the Crossref REST API (e.g. a local stand-in server for benchmarks)")
+    parser.add_argument("--no-cache", action = "store_true", help = "do not read or write the Crossref cache")
+    parser.add_argument("--cache-file", help = f"Crossref cache file (defaults to {CROSSREF_CACHE_FILE} in the output folder)")
+    parser.add_argument("--cache-ttl-days", type = float, default = crossref_cache.DEFAULT_TTL_DAYS,
+                        help = "days Crossref data is kept in the cache")
+    parser.add_argument("--non-crossref-ttl-days", type = float, default = crossref_cache.NON_CROSSREF_TTL_DAYS,
+                        help = "days a \"not a Crossref DOI\" verdict is kept in the cache")
+    parser.add_argument("--embargo-ttl-days", type = float, default = crossref_cache.EMBARGO_TTL_DAYS,
+                        help = "days Crossref data for embargoed records is kept in the cache")
+    parser.add_argument("--cache-max-entries", type = int, default = crossref_cache.DEFAULT_MAX_ENTRIES,
+                        help = "maximum number of entries kept in the cache")
+    parser.add_argument("--snapshot", help = "local Crossref index built with crossref_snapshot.py; DOIs found in it are "
+                                             "not looked up through the Crossref API")
+    parser.add_argument("--offline", action = "store_true",
+                        help = "never call the Crossref API; DOIs missing from the snapshot and cache get no Crossref data")
+    parser.add_argument("--resume", action = "store_true",
+                        help = "skip research outputs that were completed by a previous run with the same output folder")
+    parser.add_argument("--retry-failures", action = "store_true",
+                        help = "only run research outputs whose GET or PUT request or Crossref lookup failed in a previous run")
+    parser.add_argument("--dry-run", action = "store_true",
+                        help = "work out every change but do not send any PUT requests")
+    parser.add_argument("--incremental", action = "store_true",
+                        help = "only process research outputs that are new, have a new DOI, whose embargo has ended or whose "
+                               "Crossref metadata was updated since the last incremental run with the same output folder")
+    parser.add_argument("--prefetch", action = "store_true",
+                        help = "read the research outputs of each batch with paged requests to the search endpoint instead of "
+                               "one GET request each")
+    parser.add_argument("--search-url", help = "URL of the research output search endpoint (defaults to the --url value "
+                                               "followed by \"search\")")
+    parser.add_argument("--prefetch-fields", default = ",".join(PREFETCH_FIELDS),
+                        help = "comma separated fields selected by the prefetch requests (empty for all fields)")
+    parser.add_argument("--prefetch-size", type = int, default = PREFETCH_PAGE_SIZE,
+                        help = "number of research outputs requested per prefetch request")
+    parser.add_argument("--shard", type = shard_spec,
+                        help = "only process the research outputs in shard INDEX/SHARDS (split by a hash of the UUID), e.g. to "
+                               "spread a run over several hosts; use a separate output folder for every shard")
+    parser.add_argument("--no-progress", action = "store_true", help = "do not show the progress bar")
+    return parser
+
+
+def parse_args(argv: list = None, parser: argparse.ArgumentParser = None) -> argparse.Namespace:
+
+    """
+    Returns the settings for a run, read from the command line, an optional INI config file and the PURE_API_KEY environment
+    variable, in that order of precedence. Missing required settings are asked for interactively. A parser with extra options
+    (see shard_runner.py) can be passed in place of the default one.
+    """
+
+    if parser is None:
+        parser = build_parser()
+
+    args, _ = parser.parse_known_args(argv)
+    if args.config is not None:
+        config = configparser.ConfigParser()
+        if not config.read(args.config, encoding = "utf-8"):
+            parser.error(f"could not read config file {args.config}")
+        if config.has_section("pure_updater"):
+            defaults = {}
+            for key in config["pure_updater"]:
+                if key in BOOLEAN_SETTINGS:
+                    defaults[key] = config["pure_updater"].getboolean(key)
+                else:
+                    defaults[key] = config["pure_updater"][key]
+            parser.set_defaults(**defaults)
+
+    args = parser.parse_args(argv)
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if not 1 <= args.crossref_batch_size <= MAX_CROSSREF_BATCH_SIZE:
+        parser.error(f"--crossref-batch-size must be between 1 and {MAX_CROSSREF_BATCH_SIZE}")
+    if args.api_key is None:
+        args.api_key = os.environ.get("PURE_API_KEY")
+
+    for setting, prompt in PROMPTS.items():
+        if getattr(args, setting) is None:
+            setattr(args, setting, ask(parser, prompt, f"--{setting.replace('_', '-')} is required"))
+
+    args.csv = clean_path(args.csv)
+    args.out_folder = clean_path(args.out_folder)
+    while not os.path.isfile(args.csv):
+        print(args.csv, 'is not a valid file. Please enter a valid file name (any slashes should be forward slashes and no quotation marks).')
+        args.csv = clean_path(ask(parser, "Enter the file path to the csv file of research outputs you would like to update: ",
+                                  f"{args.csv} is not a valid file"))
+
+    return args
+
+
+def ask(parser: argparse.ArgumentParser, prompt: str, error: str) -> str:
+
+    """
+    Asks the user for a setting, or stops with an error if there is nobody to ask (e.g. when run from cron)
+    """
+
+    try:
+        return input(prompt)
+    except EOFError:
+        parser.error(error)
+
+
+def write_exit_report(path: str, counts: dict):
+
+    """
+    Writes the counters of a run to the exit report and prints the main ones
+    """
+
+    verb = "would be" if counts["dry_run"] else "were"
+    lines = [
+        f"{counts['updated']} research outputs {verb} updated.",
+        f"{counts['license_updated']} license values {verb} updated.",
+        f"{counts['epub_updated']} epub dates {verb} written.",
+        f"{counts['up_to_date']} research outputs were already up to date.",
+        f"{counts['get_errors']} get request errors, {counts['put_errors']} put request errors and {counts['crossref_errors']} "
+        f"Crossref lookup errors occurred.",
+    ]
+    if counts["no_electronic_version"]:
+        lines.append(f"{counts['no_electronic_version']} license values were not written because the research output has no electronic version.")
+    if counts["duplicate_uuids"] or counts["missing_uuids"]:
+        lines.append(f"{counts['duplicate_uuids']} rows with a repeated UUID and {counts['missing_uuids']} rows without a UUID were skipped.")
+    if counts["resumed"]:
+        lines.append(f"{counts['resumed']} research outputs were skipped because of a previous run.")
+    if counts["snapshot_hits"] or counts["snapshot_misses"]:
+        lines.append(f"{counts['snapshot_hits']} Crossref lookups were answered from the local snapshot and {counts['snapshot_misses']} were not in it.")
+    if counts["cache_hits"] or counts["cache_misses"]:
+        lines.append(f"{counts['cache_hits']} Crossref lookups were answered from the cache.")
+        lines.append(f"{counts['cache_misses']} Crossref lookups were not in the cache ({counts['cache_expired']} cache entries had expired).")
+        lines.append(f"{counts['cache_evicted']} cache entries were evicted.")
+    if counts["prefetched"]:
+        lines.append(f"{counts['prefetched']} research outputs were read through the search endpoint instead of a GET request.")
+    if counts["unchanged"]:
+        lines.append(f"{counts['unchanged']} research outputs were skipped because nothing changed since the last sync.")
+    lines.append(f"The Crossref harvest took {counts['harvest_seconds']:.1f} seconds of the {counts['elapsed_seconds']:.1f} second run.")
+    for stage, stage_summary in counts["stages"].items():
+        lines.append(f"{stage}: {stage_summary['requests']} requests, {stage_summary['failures']} failed, {stage_summary['retries']} retries, "
+                     f"latency p50 {stage_summary['p50_ms']} ms, p95 {stage_summary['p95_ms']} ms, p99 {stage_summary['p99_ms']} ms.")
+
+    with open(path, "w+", encoding = "utf-8-sig", errors = "replace") as exit_report:
+        for line in lines:
+            exit_report.write(line + "\n")
+
+    for line in lines[:4]:
+        print(line)
+
+
+def run(args: argparse.Namespace) -> dict:
+
+    """
+    Updates the research outputs in the CSV file named in the settings and returns the counters written to the exit report
+    """
+
+    started = time.monotonic()
+    url = args.url
+    out_folder = args.out_folder
+    counts = {
+        "dry_run": args.dry_run, "updated": 0, "up_to_date": 0, "license_updated": 0, "epub_updated": 0, "get_errors": 0, "put_errors": 0,
+        "crossref_errors": 0, "no_electronic_version": 0, "resumed": 0, "unchanged": 0, "prefetched": 0, "duplicate_uuids": 0, "missing_uuids": 0,
+        "cache_hits": 0, "cache_misses": 0, "cache_expired": 0, "cache_evicted": 0, "snapshot_hits": 0, "snapshot_misses": 0, "harvest_seconds": 0.0, "elapsed_seconds": 0.0,
+        "stages": {},
+    }
+
+    log = run_log.start(f"{out_folder}/{RUN_LOG_FILE}")
+    log.log("start", csv = args.csv, url = url, dry_run = args.dry_run, resume = args.resume, retry_failures = args.retry_failures,
+            shard = args.shard, incremental = args.incremental)
+
+    journal = None
+    cache = None
+    snapshot = None
+    sync = None
+    completed = False
+    try:
+        '''
+        A dry run does not write to the journal, so that a later --resume does not skip records that were never actually updated.
+        '''
+
+        resume = args.resume or args.retry_failures
+        previous_outcomes = {}
+        if resume:
+            previous_outcomes = progress_journal.load_journal(f"{out_folder}/{JOURNAL_FILE}")
+        if not args.dry_run:
+            journal = ProgressJournal(f"{out_folder}/{JOURNAL_FILE}", resume)
+
+        get_headers = {'accept': 'application/json', 'api-key': args.api_key}
+        put_headers = {'accept': 'application/json', 'api-key': args.api_key, "content-type": "application/json"}
+        search_url = args.search_url or f"{url}search"
+        prefetch_fields = [field.strip() for field in args.prefetch_fields.split(",") if field.strip()]
+
+        set_pure_concurrency(args.pure_concurrency)
+        crossref_data_harvester.set_crossref_concurrency(args.crossref_concurrency)
+        http_client.configure_host(urlparse(url).netloc, pool_size = args.pure_concurrency)
+        crossref_data_harvester.set_crossref_api(args.crossref_url)
+        http_client.configure_host(urlparse(args.crossref_url).netloc, pool_size = args.crossref_concurrency)
+
+        if not args.no_cache:
+            cache = CrossrefCache(args.cache_file or f"{out_folder}/{CROSSREF_CACHE_FILE}", args.cache_ttl_days,
+                                  args.non_crossref_ttl_days, args.embargo_ttl_days, args.cache_max_entries)
+
+        if args.snapshot is not None:
+            snapshot = CrossrefSnapshot(args.snapshot)
+
+        '''
+        An incremental run asks Crossref which of the already synced DOIs were updated since the last sync started. Crossref filters
+        by day, so the watermark is the day the sync started and that whole day is checked again by the next run. A dry run reads the
+        sync state but does not change it.
+        '''
+
+        watermark = None
+        sync_started = date.today()
+        if args.incremental:
+            sync = SyncState(f"{out_folder}/{SYNC_STATE_FILE}")
+            watermark = sync.watermark()
+            log.log("sync", watermark = watermark)
+
+        '''
+        Loop through all records in the CSV file and for each one, make a GET request to the appropriate Pure API instance to retrieve the version string, which
+        is the first piece of JSON data that will be written in through later PUT requests. Next retrieve electronic versions data and publication status
+        data to be able to write license information and E-Pub dates. Call the external library "crossref_data_harvester" to extract this information from
+        CrossRef and write it into the Pure record if certain conditions are met.
+
+        The CSV file is streamed in batches, so only one batch of rows is held in memory at a time. The Crossref data for a whole
+        batch is harvested first, then the records are handed to a pool of worker threads so that several records can wait on Pure
+        at the same time. The pool returns results in the same order as the CSV file, so the errors in the run log and the counters
+        below are identical to a one-at-a-time run.
+        '''
+
+        empty_plan = oa_transform.plan_update({"license": None, "date": None, "embargo": None})
+        reader_stats = {}
+        records = read_records(args.csv, args.doi_col, args.uuid_col, reader_stats, args.shard)
+        total = count_rows(args.csv) if args.shard is None and not args.no_progress else None
+
+        with ThreadPoolExecutor(max_workers = args.record_workers) as executor, \
+                tqdm(total = total, disable = args.no_progress) as progress:
+            while True:
+                batch = list(itertools.islice(records, args.batch_size))
+                if not batch:
+                    break
+
+                if resume:
+                    pending = []
+                    for uuid, doi in batch:
+                        outcome = previous_outcomes.get(uuid)
+                        if outcome in progress_journal.COMPLETED_OUTCOMES or (args.retry_failures and outcome is None):
+                            counts["resumed"] += 1
+                            progress.update(1)
+                        else:
+                            pending.append((uuid, doi))
+                    batch = pending
+
+                '''
+                A Crossref lookup that failed for a transient reason leaves the same empty data as a DOI without license or e-pub
+                data, so the DOIs whose lookup failed are collected separately. Their records are counted as Crossref errors and are not recorded as synced.
+                '''
+
+                harvest_failed = set()
+                harvest_started = time.monotonic()
+                if sync is not None and watermark is not None:
+                    full, known = sync_state.select_records(batch, sync.get_many([uuid for uuid, doi in batch]), sync_started)
+                    crossref_dicts = get_crossref_license_dates([doi for uuid, doi in full], args.crossref_batch_size, cache,
+                                                                snapshot, args.offline, not args.no_batch_lookup,
+                                                                harvest_failed)
+                    updates = {}
+                    if not args.offline:
+                        updates = get_crossref_updates([doi for uuid, doi in known], watermark, args.crossref_batch_size, cache,
+                                                       harvest_failed)
+                    crossref_dicts.update(updates)
+                    selected = full + [(uuid, doi) for uuid, doi in known if doi in updates]
+                    counts["unchanged"] += len(batch) - len(selected)
+                    progress.update(len(batch) - len(selected))
+                    batch = selected
+                else:
+                    crossref_dicts = get_crossref_license_dates([doi for uuid, doi in batch], args.crossref_batch_size, cache,
+                                                                snapshot, args.offline, not args.no_batch_lookup,
+                                                                harvest_failed)
+                counts["harvest_seconds"] += time.monotonic() - harvest_started
+
+                uuids = [uuid for uuid, doi in batch]
+                dois = [doi for uuid, doi in batch]
+                plans = oa_transform.plan_updates(crossref_dicts)
+
+                prefetched = {}
+                if args.prefetch:
+                    prefetched = prefetch_records(uuids, search_url, put_headers, prefetch_fields, args.prefetch_size)
+                    counts["prefetched"] += len(prefetched)
+
+                results = executor.map(lambda uuid, doi: process_record(uuid, plans.get(doi, empty_plan), url, get_headers,
+                                                                        put_headers, args.dry_run, prefetched.get(uuid)),
+                                       uuids, dois)
+
+                synced = []
+                failed = []
+                for doi, result in zip(dois, results):
+                    progress.update(1)
+                    result["crossref_error"] = doi in harvest_failed
+                    if journal is not None:
+                        journal.record(result["uuid"], doi, record_outcome(result))
+                    if result["crossref_error"]:
+                        counts["crossref_errors"] += 1
+                    if result["get_error"] is not None or result["put_error"] is not None or result["crossref_error"]:
+                        failed.append(result["uuid"])
+                    else:
+                        synced.append((result["uuid"], doi, plans.get(doi, empty_plan)["embargo"]))
+                    if result["get_error"] is not None:
+                        counts["get_errors"] += 1
+                        log.log("error", stage = "pure_get", uuid = result["uuid"], doi = doi, message = result["get_error"])
+                        continue
+                    if result["no_electronic_version"]:
+                        counts["no_electronic_version"] += 1
+                        log.log("error", stage = "pure_record", uuid = result["uuid"], doi = doi,
+                                message = "The research output has no electronic version, so the Crossref license was not written")
+                    if result["license_updated"]:
+                        counts["license_updated"] += 1
+                    if result["epub_updated"]:
+                        counts["epub_updated"] += 1
+                    if result["put_error"] is not None:
+                        counts["put_errors"] += 1
+                        log.log("error", stage = "pure_put", uuid = result["uuid"], doi = doi, message = result["put_error"])
+                    elif result["updated"]:
+                        counts["updated"] += 1
+                    elif result["up_to_date"]:
+                        counts["up_to_date"] += 1
+
+                if journal is not None:
+                    journal.sync()
+                log.flush()
+                if sync is not None and not args.dry_run:
+                    sync.set_many(synced)
+                    sync.forget(failed)
+        completed = True
+    except BaseException as err:
+        log.log("error", stage = "run", message = "The run stopped: " + repr(err))
+        raise
+    finally:
+        '''
+        However the run ends, the journal, cache, snapshot and sync state are closed and the buffered run log is written out,
+        so the requests and errors leading up to a crash are kept. Only a completed run moves the sync watermark forward.
+        '''
+        if journal is not None:
+            journal.close()
+        if sync is not None:
+            if completed and not args.dry_run:
+                sync.set_watermark(sync_started.strftime("%Y-%m-%d"))
+            sync.close()
+        if cache is not None:
+            cache.close()
+        if snapshot is not None:
+            snapshot.close()
+        if not completed:
+            run_log.stop()
+
+    counts["duplicate_uuids"] = reader_stats["duplicate_uuids"]
+    counts["missing_uuids"] = reader_stats["missing_uuids"]
+    if cache is not None:
+        counts["cache_hits"] = cache.stats["hits"]
+        counts["cache_misses"] = cache.stats["misses"]
+        counts["cache_expired"] = cache.stats["expired"]
+        counts["cache_evicted"] = cache.stats["evicted"]
+    if snapshot is not None:
+        counts["snapshot_hits"] = snapshot.stats["hits"]
+        counts["snapshot_misses"] = snapshot.stats["misses"]
+    counts["elapsed_seconds"] = time.monotonic() - started
+    counts["stages"] = log.summary()
+    log.log("end", counts = counts)
+    run_log.stop()
+
+    write_exit_report(f"{out_folder}/exit_report.txt", counts)
+
+    return counts
+
+
+def main(argv: list = None) -> dict:
+
+    """
+    Command line entry point
+    """
+
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
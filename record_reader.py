@@ -0,0 +1,81 @@
+import csv
+import zlib
+from crossref_data_harvester import normalize_doi
+
+
+def shard_of(uuid: str, shards: int) -> int:
+
+    """
+    Returns the shard (0 to shards - 1) a UUID belongs to. The hash is stable across runs, processes and hosts, so a research
+    output always lands in the same shard.
+    """
+
+    return zlib.crc32(uuid.encode("utf-8")) % shards
+
+
+def count_rows(file: str) -> int:
+
+    """
+    Returns the number of data rows in a CSV file by counting line breaks, without parsing it (used for the progress bar)
+    """
+
+    lines = 0
+    with open(file, "rb") as csv_file:
+        for block in iter(lambda: csv_file.read(1 << 20), b""):
+            lines += block.count(b"\n")
+    return max(lines - 1, 0)
+
+
+def read_records(file: str, doi_col: str, uuid_col: str, stats: dict = None, shard: tuple = None):
+
+    """
+    Yields a (uuid, doi) pair for every row of the CSV file with a normalized DOI (None if the row has no DOI). Rows without
+    a UUID and rows repeating a UUID that was already read are dropped. If a stats dictionary is given, the number of rows read,
+    dropped and repeated DOIs is counted in it. With shard given as (index, shards), only the rows whose UUID belongs to that
+    shard are read; rows without a UUID are counted by shard 0 only, so the stats of all shards add up to those of the file.
+    """
+
+    if stats is None:
+        stats = {}
+    stats.update({"rows": 0, "missing_uuids": 0, "duplicate_uuids": 0, "duplicate_dois": 0})
+    seen_uuids = set()
+    seen_dois = set()
+
+    with open(file, "r", newline = "", encoding = "utf-8-sig", errors = "replace") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader, [])
+        for column in (doi_col, uuid_col):
+            if column not in header:
+                raise ValueError(f"Column {column!r} is not in the header of {file}")
+        doi_index = header.index(doi_col)
+        uuid_index = header.index(uuid_col)
+
+        for row in reader:
+            if not row:
+                continue
+            uuid = row[uuid_index].strip() if uuid_index < len(row) else ""
+            if shard is not None and (shard_of(uuid, shard[1]) if uuid else 0) != shard[0]:
+                continue
+            stats["rows"] += 1
+
+            if not uuid:
+                stats["missing_uuids"] += 1
+                continue
+            if uuid in seen_uuids:
+                stats["duplicate_uuids"] += 1
+                continue
+            seen_uuids.add(uuid)
+
+            doi = normalize_doi(row[doi_index]) if doi_index < len(row) else ""
+            if not doi:
+                doi = None
+            elif doi in seen_dois:
+                '''
+                A repeated DOI on a different UUID is a separate Pure record and still needs its own update. The Crossref
+                data for it is shared through the batch lookup and the cache, so it is counted here but not dropped.
+                '''
+                stats["duplicate_dois"] += 1
+            else:
+                seen_dois.add(doi)
+
+            yield uuid, doi
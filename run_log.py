@@ -0,0 +1,173 @@
+import threading
+import time
+from array import array
+import json_codec
+
+'''
+Structured run log. Every request (with its stage, status code, latency and number of retries) and every error is written as
+one JSON line to a single buffered file, instead of printing to the console and appending free text to separate error files.
+Latencies are also kept per stage so the exit report can show p50/p95/p99 summaries. The updater flushes the buffer at the end
+of every batch and closes the log however the run ends, so a crash loses no more than the batch it happened in.
+
+Request stages used by the updater: pure_get, pure_search (--prefetch), pure_recheck (the GET before a PUT of a prefetched
+record), pure_put, crossref_agency and crossref_works (single DOI), crossref_filter (batch lookups) and crossref_updates (the
+from-update-date check of --incremental). Errors are logged with the stage of the failed request, or with pure_record (a record
+that cannot hold the Crossref data) or run (the exception that stopped a run).
+'''
+
+BUFFER_SIZE = 1000
+
+
+class RunLog:
+
+    """
+    Buffered JSON lines writer with per-stage latency statistics
+    """
+
+    def __init__(self, path: str, buffer_size: int = BUFFER_SIZE):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.latencies = {}
+        self.stage_stats = {}
+        self.lock = threading.Lock()
+        self.log_file = open(path, "ab")
+
+    def log(self, event: str, **fields):
+
+        """
+        Records an event with the given fields
+        """
+
+        entry = {"time": round(time.time(), 3), "event": event}
+        entry.update(fields)
+        line = json_codec.dumps(entry) + b"\n"
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.buffer_size:
+                self.flush_buffer()
+
+    def log_request(self, stage: str, method: str, url: str, status: int, latency: float, retries: int, error: str = None):
+
+        """
+        Records one request (including all of its retries) and adds its latency to the stage statistics
+        """
+
+        with self.lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = array("d")
+                self.stage_stats[stage] = {"requests": 0, "failures": 0, "retries": 0}
+            self.latencies[stage].append(latency)
+            stats = self.stage_stats[stage]
+            stats["requests"] += 1
+            stats["retries"] += retries
+            if error is not None or status is None or status >= 400:
+                stats["failures"] += 1
+
+        fields = {"stage": stage, "method": method, "url": url, "status": status, "latency_ms": round(latency * 1000, 1),
+                  "retries": retries}
+        if error is not None:
+            fields["error"] = error
+        self.log("request", **fields)
+
+    def flush(self):
+
+        """
+        Writes any buffered lines to the file, e.g. at the end of a batch so that a crash loses at most the current batch
+        """
+
+        with self.lock:
+            self.flush_buffer()
+
+    def flush_buffer(self):
+        self.log_file.write(b"".join(self.buffer))
+        self.log_file.flush()
+        self.buffer = []
+
+    def summary(self) -> dict:
+
+        """
+        Returns the request count, failures, retries and p50/p95/p99 latency in milliseconds for every stage
+        """
+
+        with self.lock:
+            return summarize(self.latencies, self.stage_stats)
+
+    def close(self):
+
+        """
+        Writes the latency summary and any buffered lines and closes the file
+        """
+
+        self.log("summary", stages = self.summary())
+        with self.lock:
+            self.flush_buffer()
+            self.log_file.close()
+
+
+def summarize(latencies: dict, stage_stats: dict) -> dict:
+
+    """
+    Returns the summary of RunLog.summary for per-stage latencies (in seconds) and request/failure/retry counts
+    """
+
+    summary = {}
+    for stage, stage_latencies in latencies.items():
+        ordered = sorted(stage_latencies)
+        stage_summary = dict(stage_stats[stage])
+        for name, fraction in (("p50_ms", 0.50), ("p95_ms", 0.95), ("p99_ms", 0.99)):
+            index = min(int(fraction * len(ordered)), len(ordered) - 1)
+            stage_summary[name] = round(ordered[index] * 1000, 1)
+        summary[stage] = stage_summary
+    return summary
+
+
+'''
+The log that requests and errors are currently written to. It is set by the updater for the length of a run; when no log is
+active (e.g. when the harvester is used on its own) nothing is recorded.
+'''
+
+active_log = None
+
+
+def start(path: str) -> RunLog:
+
+    """
+    Opens a run log and makes it the active one
+    """
+
+    global active_log
+    active_log = RunLog(path)
+    return active_log
+
+
+def stop():
+
+    """
+    Closes the active run log
+    """
+
+    global active_log
+    if active_log is not None:
+        active_log.close()
+        active_log = None
+
+
+def log(event: str, **fields):
+
+    """
+    Records an event in the active run log, if there is one
+    """
+
+    if active_log is not None:
+        active_log.log(event, **fields)
+
+
+def log_request(stage: str, method: str, url: str, status: int, latency: float, retries: int, error: str = None):
+
+    """
+    Records a request in the active run log, if there is one
+    """
+
+    if active_log is not None:
+        active_log.log_request(stage, method, url, status, latency, retries, error)
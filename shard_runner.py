@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+import http_client
+import pure_updater
+import run_log
+
+'''
+Runs the updater as several processes, each handling one shard of the CSV file. Research outputs are assigned to shards by a
+hash of their UUID (see record_reader.shard_of), so a record always lands in the same shard and each shard keeps its own
+journal, Crossref cache and run log in a folder of its own ("shard_1_of_4" etc. in the output folder). Resuming works per shard
+as long as the number of shards stays the same.
+
+The shards share one rate limit towards Crossref (and optionally Pure), so adding processes does not push more requests onto
+the APIs than those limits allow. When every shard has finished, their counters, errors and request latencies are merged into
+one exit report in the output folder.
+
+A run can also be spread over several hosts: run "pure_updater.py --shard 1/4" (2/4, ...) with its own output folder on each
+host, copy the folders to one place and merge them with "shard_runner.py merge OUTPUT_FOLDER SHARD_FOLDER ...". Each host then
+has its own rate limit, so divide the API quota between them.
+'''
+
+SHARDS = os.cpu_count() or 4
+
+'''
+Requests per second allowed towards Crossref by all shards together. Keep this below the rate Crossref advertises in its
+X-Rate-Limit-Limit and X-Rate-Limit-Interval headers.
+'''
+
+CROSSREF_RATE = 10.0
+
+MERGED_ERRORS_FILE = "shard_errors.jsonl"
+
+
+def shard_folder(out_folder: str, index: int, shards: int) -> str:
+    return f"{out_folder}/shard_{index + 1}_of_{shards}"
+
+
+def init_shard(rate_limits: dict):
+
+    """
+    Sets up the shared rate limits in a shard process
+    """
+
+    for host, rate_limit in rate_limits.items():
+        http_client.share_rate_limit(host, rate_limit)
+
+
+def run_shard(args: argparse.Namespace) -> dict:
+    return pure_updater.run(args)
+
+
+def read_shard_log(path: str) -> tuple:
+
+    """
+    Returns the counters, error events and per-stage request latencies and counts of the last run recorded in a shard's run log
+    """
+
+    counts = None
+    errors = []
+    latencies = {}
+    stage_stats = {}
+    with open(path, "rb") as run_log_file:
+        for line in run_log_file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            event = entry.get("event")
+            if event == "start":
+                counts = None
+                errors = []
+                latencies = {}
+                stage_stats = {}
+            elif event == "request":
+                stage = entry["stage"]
+                if stage not in latencies:
+                    latencies[stage] = array("d")
+                    stage_stats[stage] = {"requests": 0, "failures": 0, "retries": 0}
+                latencies[stage].append(entry["latency_ms"] / 1000)
+                stats = stage_stats[stage]
+                stats["requests"] += 1
+                stats["retries"] += entry["retries"]
+                if "error" in entry or entry["status"] is None or entry["status"] >= 400:
+                    stats["failures"] += 1
+            elif event in ("error", "not_crossref"):
+                errors.append(entry)
+            elif event == "end":
+                counts = entry["counts"]
+    return counts, errors, latencies, stage_stats
+
+
+def merge_shards(out_folder: str, folders: list, elapsed_seconds: float = None) -> dict:
+
+    """
+    Merges the run logs of finished shards into one exit report and error file in out_folder and returns the merged counters.
+    Counters are added up, except for the harvest time and run time, which are those of the slowest shard (or elapsed_seconds
+    if given).
+    """
+
+    merged = None
+    latencies = {}
+    stage_stats = {}
+    with open(f"{out_folder}/{MERGED_ERRORS_FILE}", "wb") as errors_file:
+        for folder in folders:
+            path = f"{folder}/{pure_updater.RUN_LOG_FILE}"
+            counts, errors, shard_latencies, shard_stage_stats = read_shard_log(path)
+            if counts is None:
+                raise ValueError(f"{path} does not hold a finished run")
+
+            for entry in errors:
+                entry["shard"] = os.path.basename(os.path.normpath(folder))
+                errors_file.write(json.dumps(entry, separators = (",", ":")).encode("utf-8") + b"\n")
+
+            for stage, stage_latencies in shard_latencies.items():
+                if stage not in latencies:
+                    latencies[stage] = array("d")
+                    stage_stats[stage] = {"requests": 0, "failures": 0, "retries": 0}
+                latencies[stage].extend(stage_latencies)
+                for key, value in shard_stage_stats[stage].items():
+                    stage_stats[stage][key] += value
+
+            if merged is None:
+                merged = dict(counts)
+                continue
+            for key, value in counts.items():
+                if key == "dry_run":
+                    merged[key] = merged[key] or value
+                elif key in ("harvest_seconds", "elapsed_seconds"):
+                    merged[key] = max(merged[key], value)
+                elif isinstance(value, (int, float)):
+                    merged[key] += value
+
+    merged["stages"] = run_log.summarize(latencies, stage_stats)
+    if elapsed_seconds is not None:
+        merged["elapsed_seconds"] = elapsed_seconds
+    pure_updater.write_exit_report(f"{out_folder}/exit_report.txt", merged)
+    return merged
+
+
+def run(args: argparse.Namespace) -> dict:
+
+    """
+    Runs every shard in a pool of processes and returns the merged counters
+    """
+
+    started = time.monotonic()
+    rate_limits = {}
+    if args.crossref_rate:
+        rate_limits[urlparse(args.crossref_url).netloc] = http_client.SharedRateLimit(args.crossref_rate)
+    if args.pure_rate:
+        rate_limits[urlparse(args.url).netloc] = http_client.SharedRateLimit(args.pure_rate)
+
+    folders = []
+    shard_args = []
+    for index in range(args.shards):
+        folder = shard_folder(args.out_folder, index, args.shards)
+        os.makedirs(folder, exist_ok = True)
+        folders.append(folder)
+        shard_args.append(argparse.Namespace(**{**vars(args), "shard": (index, args.shards), "out_folder": folder,
+                                                "no_progress": True}))
+
+    with ProcessPoolExecutor(max_workers = args.processes or args.shards, initializer = init_shard,
+                             initargs = (rate_limits,)) as executor:
+        list(executor.map(run_shard, shard_args))
+
+    return merge_shards(args.out_folder, folders, time.monotonic() - started)
+
+
+def main(argv: list = None) -> dict:
+
+    """
+    Command line entry point
+    """
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if argv[:1] == ["merge"]:
+        parser = argparse.ArgumentParser(prog = "shard_runner.py merge",
+                                         description = "Merge the output folders of shards run on several hosts.")
+        parser.add_argument("out_folder", help = "folder for the merged exit report and error file")
+        parser.add_argument("folders", nargs = "+", help = "output folders of the shards")
+        args = parser.parse_args(argv[1:])
+        return merge_shards(args.out_folder, args.folders)
+
+    parser = pure_updater.build_parser()
+    parser.description = "Run the updater as several processes, each handling a shard of the CSV file."
+    parser.add_argument("--shards", type = int, default = SHARDS, help = "number of shards (and processes) to run")
+    parser.add_argument("--processes", type = int, help = "number of shards run at the same time (defaults to --shards)")
+    parser.add_argument("--crossref-rate", type = float, default = CROSSREF_RATE,
+                        help = "Crossref requests per second allowed for all shards together (0 for no shared limit)")
+    parser.add_argument("--pure-rate", type = float, default = 0,
+                        help = "Pure requests per second allowed for all shards together (0 for no shared limit)")
+    args = pure_updater.parse_args(argv, parser)
+    if args.shard is not None:
+        parser.error("--shard cannot be used with shard_runner.py, which runs every shard")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    return run(args)
+
+
+if __name__ == "__main__":
+    main()
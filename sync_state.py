@@ -0,0 +1,94 @@
+import sqlite3
+from datetime import date
+
+'''
+State kept between incremental runs (--incremental): the date of the last completed sync (the watermark) and, for every
+research output that was processed, the DOI it had and the embargo end date written to it. A research output only has to be
+processed again if it is new, its DOI changed, its embargo has ended or Crossref has updated the metadata of its DOI since the
+watermark.
+'''
+
+
+class SyncState:
+
+    """
+    SQLite file holding the sync watermark and the DOI and embargo end date of every synced research output
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sync_watermark (name TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sync_records (uuid TEXT PRIMARY KEY, doi TEXT, embargo_end TEXT)")
+        self.connection.commit()
+
+    def watermark(self) -> str:
+
+        """
+        Returns the date (YYYY-MM-DD) the last completed sync started on, or None if there has not been one
+        """
+
+        row = self.connection.execute("SELECT value FROM sync_watermark WHERE name = 'crossref'").fetchone()
+        return row[0] if row is not None else None
+
+    def set_watermark(self, value: str):
+        self.connection.execute("INSERT OR REPLACE INTO sync_watermark VALUES ('crossref', ?)", (value,))
+        self.connection.commit()
+
+    def get_many(self, uuids: list) -> dict:
+
+        """
+        Returns a dictionary keyed by UUID with the (doi, embargo_end) recorded for every UUID that has been synced
+        """
+
+        found = {}
+        for start in range(0, len(uuids), 500):
+            chunk = uuids[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT uuid, doi, embargo_end FROM sync_records WHERE uuid IN ({','.join('?' * len(chunk))})", chunk
+            )
+            for uuid, doi, embargo_end in rows:
+                found[uuid] = (doi, embargo_end)
+        return found
+
+    def set_many(self, records: list):
+
+        """
+        Records a list of (uuid, doi, embargo_end) tuples for research outputs that were synced
+        """
+
+        self.connection.executemany("INSERT OR REPLACE INTO sync_records VALUES (?, ?, ?)", records)
+        self.connection.commit()
+
+    def forget(self, uuids: list):
+
+        """
+        Removes research outputs from the state so that the next run processes them in full (used when a request failed)
+        """
+
+        self.connection.executemany("DELETE FROM sync_records WHERE uuid = ?", [(uuid,) for uuid in uuids])
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def select_records(batch: list, synced: dict, today: date) -> tuple:
+
+    """
+    Splits a batch of (uuid, doi) pairs into the records that need a full Crossref lookup (new, changed DOI or ended embargo)
+    and the records that only need processing if Crossref has updated their DOI since the watermark
+    """
+
+    full = []
+    known = []
+    today_string = today.strftime("%Y-%m-%d")
+    for uuid, doi in batch:
+        state = synced.get(uuid)
+        if state is None or state[0] != doi:
+            full.append((uuid, doi))
+        elif state[1] is not None and state[1] <= today_string:
+            full.append((uuid, doi))
+        else:
+            known.append((uuid, doi))
+    return full, known